@@ -0,0 +1,67 @@
+import hashlib
+import json
+import mimetypes
+import os
+from flask import abort, request, send_from_directory, url_for
+
+# Fingerprinted files never change, so clients may keep them for a year
+IMMUTABLE_MAX_AGE = 31536000
+
+# Precompressed variants in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+class Assets:
+    """Serve the fingerprinted assets written by build_assets.py
+
+    Registers the asset_url() template helper and the /assets route, which
+    serves precompressed variants when the client accepts them. Without a
+    build, asset_url() falls back to the plain static files.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.files = set()
+        self.version = 'static'
+        self.dist_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dist_dir = os.path.join(app.static_folder, 'dist')
+        manifest_file = os.path.join(self.dist_dir, 'manifest.json')
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self.manifest = json.load(f)
+        self.files = set(self.manifest.values())
+        if self.manifest:
+            # Identifies the build, pages embedding asset URLs must vary with it
+            self.version = hashlib.sha256(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:8]
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.add_template_global(self.asset_url, 'asset_url')
+
+    def asset_url(self, path):
+        """Return the URL of a static asset, fingerprinted when built"""
+        if path in self.manifest:
+            return url_for('assets', filename=self.manifest[path])
+        return url_for('static', filename=path)
+
+    def serve(self, filename):
+        if filename not in self.files:
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if encoding in request.accept_encodings and os.path.exists(os.path.join(self.dist_dir, filename + suffix)):
+                response = send_from_directory(self.dist_dir, filename + suffix,
+                                               mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+                response.content_encoding = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.dist_dir, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,167 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+# Added after the first release, created on catalogs that lack them
+VERIFICATION_COLUMNS = [
+    ('verify_status', 'TEXT'),  # 'ok' or 'failed', NULL until verified
+    ('verified_at', 'TEXT'),
+    ('verify_duration', 'REAL'),
+    ('verify_error', 'TEXT'),
+]
+
+
+class BackupCatalog:
+    """Index of the backups in a backup directory
+
+    Kept in a small SQLite file next to the backups, so listing them does not
+    scan the directory and parse every metadata.json. The catalog is rebuilt
+    from the directory whenever the file is missing.
+    """
+
+    def __init__(self, backup_dir, filename='catalog.sqlite'):
+        self.backup_dir = backup_dir
+        self.path = os.path.join(backup_dir, filename)
+
+        is_new = not os.path.exists(self.path)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS backups (
+                    path TEXT PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    users INTEGER,
+                    encrypted_data INTEGER
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_backups_timestamp ON backups (timestamp)")
+            columns = {row['name'] for row in connection.execute("PRAGMA table_info(backups)")}
+            for name, column_type in VERIFICATION_COLUMNS:
+                if name not in columns:
+                    connection.execute(f"ALTER TABLE backups ADD COLUMN {name} {column_type}")
+        if is_new:
+            self.rebuild()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def add(self, backup_path, metadata):
+        """Add or replace the entry of a backup"""
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO backups (path, timestamp, users, encrypted_data) VALUES (?, ?, ?, ?)",
+                (backup_path, metadata['timestamp'], metadata['items']['users'], metadata['items']['encrypted_data'])
+            )
+
+    def remove(self, backup_path):
+        """Remove the entry of a backup"""
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM backups WHERE path = ?", (backup_path,))
+
+    def set_verification(self, backup_path, status, duration, error=None):
+        """Record the result of verifying a backup"""
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE backups SET verify_status = ?, verified_at = ?, verify_duration = ?, verify_error = ? WHERE path = ?",
+                (status, datetime.now().strftime(TIMESTAMP_FORMAT), duration, error, backup_path)
+            )
+
+    def list_unverified(self, limit=None):
+        """List the backups that were not verified yet, newest first"""
+        query = "SELECT * FROM backups WHERE verify_status IS NULL ORDER BY timestamp DESC"
+        params = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [self._to_backup(row) for row in rows]
+
+    def count(self):
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM backups").fetchone()[0]
+
+    def list(self, limit=None, offset=0):
+        """List backups, newest first"""
+        query = "SELECT * FROM backups ORDER BY timestamp DESC"
+        params = ()
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params = (limit, offset)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [self._to_backup(row) for row in rows]
+
+    def rebuild(self):
+        """Rebuild the catalog by scanning the backup directory"""
+        entries = []
+        for item in os.listdir(self.backup_dir):
+            backup_path = os.path.join(self.backup_dir, item)
+            metadata_file = os.path.join(backup_path, 'metadata.json')
+            if os.path.isdir(backup_path) and os.path.exists(metadata_file):
+                with open(metadata_file, 'r') as f:
+                    metadata = json.load(f)
+                entries.append((
+                    backup_path, metadata['timestamp'],
+                    metadata['items']['users'], metadata['items']['encrypted_data']
+                ))
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM backups")
+            connection.executemany(
+                "INSERT INTO backups (path, timestamp, users, encrypted_data) VALUES (?, ?, ?, ?)",
+                entries
+            )
+        return len(entries)
+
+    @staticmethod
+    def _to_backup(row):
+        return {
+            'path': row['path'],
+            'timestamp': row['timestamp'],
+            'items': {
+                'users': row['users'],
+                'encrypted_data': row['encrypted_data']
+            },
+            'verification': {
+                'status': row['verify_status'],
+                'verified_at': row['verified_at'],
+                'duration': row['verify_duration'],
+                'error': row['verify_error']
+            }
+        }
+
+
+def select_expired(backups, keep_hourly, keep_daily, keep_weekly):
+    """Pick the backups a grandfather-father-son policy no longer keeps
+
+    The newest backup of each of the last keep_hourly hours, keep_daily days
+    and keep_weekly ISO weeks is kept, as is the newest backup overall.
+    """
+    backups = sorted(backups, key=lambda backup: backup['timestamp'], reverse=True)
+    if not backups:
+        return []
+
+    keep = {backups[0]['path']}
+    tiers = [
+        (keep_hourly, lambda t: (t.date(), t.hour)),
+        (keep_daily, lambda t: t.date()),
+        (keep_weekly, lambda t: t.isocalendar()[:2]),
+    ]
+    for limit, bucket_of in tiers:
+        buckets = set()
+        for backup in backups:
+            if len(buckets) >= limit:
+                break
+            bucket = bucket_of(datetime.strptime(backup['timestamp'], TIMESTAMP_FORMAT))
+            if bucket not in buckets:
+                # The first backup seen in a bucket is its newest one
+                buckets.add(bucket)
+                keep.add(backup['path'])
+
+    return [backup for backup in backups if backup['path'] not in keep]
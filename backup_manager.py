@@ -1,54 +1,73 @@
 import os
 import json
+import hashlib
+import random
 import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import threading
 import time
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, insert, select, DateTime
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
-from models import Base, User, EncryptedData
-from config import Config
+from extensions import db, change_journal
+from models import Base, User, EncryptedData, SearchIndex, VaultStats, VaultTransfer, decrypt_value
+from backup_catalog import BackupCatalog, select_expired, TIMESTAMP_FORMAT
+from change_journal import read_records, prune_segments, encode_row, journaled_columns
+import search_index
+import vault_cache
+import vault_stats
+
+def _decode_row(table, row):
+    """Convert a row of a backup or the change journal back to column values"""
+    values = {}
+    for column in journaled_columns(table):
+        value = row.get(column.name)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        values[column.name] = value
+    return values
+
+def _insert_record(table, values):
+    return {'op': 'i', 'tbl': table.name, 'row': encode_row(table, values)}
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 of a file, hashlib releases the GIL so files hash in parallel"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 class BackupManager:
-    def __init__(self, db_url, backup_dir="backups"):
+    # Files of a backup, besides metadata.json
+    BACKUP_FILES = ('database.db', 'users.json', 'encrypted_data.json')
+    
+    def __init__(self, db_url, backup_dir="backups", read_db_url=None, journal_dir=None,
+                 verify_workers=2, verify_sample_size=100):
         self.db_url = db_url
         self.backup_dir = backup_dir
+        self.journal_dir = journal_dir
+        self.verify_workers = verify_workers
+        self.verify_sample_size = verify_sample_size
         self.engine = create_engine(db_url)
         self.Session = sessionmaker(bind=self.engine)
         
+        # JSON exports read from a replica when one is configured, unless the
+        # journal is replayed on top of them (see create_backup)
+        self.read_engine = create_engine(read_db_url) if read_db_url else self.engine
+        self.ReadSession = sessionmaker(bind=self.read_engine)
+        
         # Create backup directory if it doesn't exist
         os.makedirs(backup_dir, exist_ok=True)
-        
-        self.backup_thread = None
-        self.is_running = False
-    
-    def start_backup(self):
-        """Start the backup process in a background thread"""
-        if not self.is_running:
-            self.is_running = True
-            self.backup_thread = threading.Thread(target=self._backup_loop)
-            self.backup_thread.daemon = True
-            self.backup_thread.start()
-    
-    def stop_backup(self):
-        """Stop the backup process"""
-        self.is_running = False
-        if self.backup_thread:
-            self.backup_thread.join()
-    
-    def _backup_loop(self):
-        """Main backup loop"""
-        while self.is_running:
-            try:
-                self.create_backup()
-                time.sleep(Config.BACKUP_INTERVAL)
-            except Exception as e:
-                print(f"Backup error: {e}")
-                time.sleep(60)  # Wait a minute before retrying
+        self.catalog = BackupCatalog(backup_dir)
     
     def create_backup(self):
         """Create a new backup of the database"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
         backup_path = os.path.join(self.backup_dir, f"backup_{timestamp}")
         
         # Create backup directory
@@ -60,8 +79,11 @@ class BackupManager:
             db_file = self.db_url.replace('sqlite:///', '')
             shutil.copy2(db_file, os.path.join(backup_path, 'database.db'))
         
-        # Export data as JSON
-        session = self.Session()
+        # Export data as JSON, journal records after this time are replayed on top.
+        # A lagging replica could miss commits from before it, which the replay
+        # would skip too, so those exports read from the primary.
+        snapshot_time = time.time()
+        session = self.Session() if self.journal_dir else self.ReadSession()
         try:
             # Export users
             users = session.query(User).all()
@@ -70,6 +92,7 @@ class BackupManager:
                 'username': user.username,
                 'password_hash': user.password_hash,
                 'email': user.email,
+                'is_admin': user.is_admin,
                 'created_at': user.created_at.isoformat()
             } for user in users]
             
@@ -83,6 +106,7 @@ class BackupManager:
                 'user_id': item.user_id,
                 'data_type': item.data_type,
                 'encrypted_content': item.encrypted_content,
+                'encrypted_tags': item.encrypted_tags,
                 'created_at': item.created_at.isoformat(),
                 'updated_at': item.updated_at.isoformat()
             } for item in encrypted_data]
@@ -93,70 +117,51 @@ class BackupManager:
         finally:
             session.close()
         
-        # Create backup metadata
+        # Create backup metadata, with checksums for the verifier
         metadata = {
             'timestamp': timestamp,
+            'snapshot_time': snapshot_time,
             'database_url': self.db_url,
             'backup_type': 'full',
             'items': {
                 'users': len(users_data),
                 'encrypted_data': len(data_items)
-            }
+            },
+            'files': self._describe_files(backup_path)
         }
+        metadata['files']['users.json']['rows'] = len(users_data)
+        metadata['files']['encrypted_data.json']['rows'] = len(data_items)
         
         with open(os.path.join(backup_path, 'metadata.json'), 'w') as f:
             json.dump(metadata, f, indent=2)
         
+        self.catalog.add(backup_path, metadata)
         return backup_path
     
     def restore_backup(self, backup_path):
-        """Restore data from a backup"""
+        """Restore data from a backup
+        
+        The users and items are restored from the JSON export in one
+        transaction on the live schema. The SQLite copy of the backup is not
+        copied over the database: its schema may predate later migrations,
+        and a failed restore could not be rolled back.
+        """
         if not os.path.exists(backup_path):
             raise ValueError(f"Backup path does not exist: {backup_path}")
         
         session = self.Session()
         try:
-            # Restore database file if using SQLite
-            if self.db_url.startswith('sqlite'):
-                db_file = self.db_url.replace('sqlite:///', '')
-                backup_db = os.path.join(backup_path, 'database.db')
-                if os.path.exists(backup_db):
-                    shutil.copy2(backup_db, db_file)
+            # Versions must keep increasing across the restore, or clients
+            # could revalidate stale pages against the restored vaults
+            vault_version = session.query(func.max(User.vault_version)).scalar() or 0
             
-            # Clear existing data
-            session.query(EncryptedData).delete()
-            session.query(User).delete()
+            records = self._replace_all(session, *self._load_snapshot(backup_path))
             
-            # Restore users
-            users_file = os.path.join(backup_path, 'users.json')
-            if os.path.exists(users_file):
-                with open(users_file, 'r') as f:
-                    users_data = json.load(f)
-                
-                for user_data in users_data:
-                    user = User(
-                        username=user_data['username'],
-                        password_hash=user_data['password_hash'],
-                        email=user_data['email'],
-                        created_at=datetime.fromisoformat(user_data['created_at'])
-                    )
-                    session.add(user)
-            
-            # Restore encrypted data
-            data_file = os.path.join(backup_path, 'encrypted_data.json')
-            if os.path.exists(data_file):
-                with open(data_file, 'r') as f:
-                    data_items = json.load(f)
-                
-                for item_data in data_items:
-                    item = EncryptedData(
-                        user_id=item_data['user_id'],
-                        data_type=item_data['data_type'],
-                        encrypted_content=item_data['encrypted_content'],
-                        created_at=datetime.fromisoformat(item_data['created_at']),
-                        updated_at=datetime.fromisoformat(item_data['updated_at'])
-                    )
-                    session.add(item)
+            # Rebuild the search index for the restored items
+            search_index.rebuild_index(session)
+            vault_stats.rebuild_stats(session)
+            session.query(User).update({User.vault_version: vault_version}, synchronize_session=False)
+            vault_cache.bump_vault_version(session)
             
             session.commit()
             
@@ -165,28 +170,327 @@ class BackupManager:
             raise e
         finally:
             session.close()
+        change_journal.append(records)
+    
+    def recover(self, target_time, user_id=None, data_id=None):
+        """Recover the vaults as they were at target_time
+        
+        Starts from the newest backup taken before target_time and replays the
+        change journal up to it. With user_id or data_id only that user's items
+        or that item are replaced, everything else is left as it is. Returns
+        the number of recovered items.
+        """
+        until = target_time.timestamp()
+        snapshot_time = None
+        for backup in self.catalog.list():
+            backup_time = self._snapshot_time(backup)
+            if backup_time <= until and os.path.exists(backup['path']):
+                snapshot_time = backup_time
+                break
+        if snapshot_time is None:
+            raise ValueError(f"No backup was taken before {target_time}")
+        users, items = self._load_snapshot(backup['path'])
+        
+        # Replay the journal on top of the snapshot, rows are full images
+        for record in read_records(self.journal_dir, since=snapshot_time, until=until):
+            if record['op'] == 'reset':
+                users.clear()
+                items.clear()
+                continue
+            rows = users if record['tbl'] == User.__tablename__ else items
+            if record['op'] == 'd':
+                rows.pop(record['row']['id'], None)
+            else:
+                rows[record['row']['id']] = record['row']
+        
+        if user_id is not None:
+            users = {user_id: users[user_id]} if user_id in users else {}
+            items = {item_id: row for item_id, row in items.items() if row['user_id'] == user_id}
+            scope = EncryptedData.user_id == user_id
+        elif data_id is not None:
+            users = {}
+            items = {data_id: items[data_id]} if data_id in items else {}
+            scope = EncryptedData.id == data_id
+        
+        session = self.Session()
+        try:
+            if user_id is None and data_id is None:
+                vault_version = session.query(func.max(User.vault_version)).scalar() or 0
+                records = self._replace_all(session, users, items)
+                search_index.rebuild_index(session)
+                vault_stats.rebuild_stats(session)
+                session.query(User).update({User.vault_version: vault_version}, synchronize_session=False)
+                vault_cache.bump_vault_version(session)
+            else:
+                records = self._replace_scope(session, scope, users, items, user_id)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        change_journal.append(records)
+        return len(items)
+    
+    def verify_backup(self, backup_path):
+        """Check a backup's checksums and test-restore it into a scratch database
+        
+        The files are hashed and the restore runs in parallel on at most
+        verify_workers threads. The result is recorded in the catalog; returns
+        the list of problems found.
+        """
+        started = time.monotonic()
+        try:
+            with open(os.path.join(backup_path, 'metadata.json'), 'r') as f:
+                metadata = json.load(f)
+            
+            with ThreadPoolExecutor(max_workers=self.verify_workers) as executor:
+                checks = [executor.submit(self._check_file, backup_path, name, expected)
+                          for name, expected in metadata.get('files', {}).items()]
+                if os.path.exists(os.path.join(backup_path, 'database.db')):
+                    checks.append(executor.submit(self._check_sqlite, os.path.join(backup_path, 'database.db')))
+                checks.append(executor.submit(self._test_restore, backup_path, metadata))
+                problems = [problem for check in checks for problem in check.result()]
+        except Exception as e:
+            problems = [f"Verification failed: {e}"]
+        
+        duration = time.monotonic() - started
+        self.catalog.set_verification(backup_path, 'failed' if problems else 'ok', duration,
+                                      '; '.join(problems) or None)
+        return problems
+    
+    def verify_pending(self, limit=1):
+        """Verify the newest backups that have not been verified yet"""
+        results = {}
+        for backup in self.catalog.list_unverified(limit=limit):
+            results[backup['path']] = self.verify_backup(backup['path'])
+        return results
     
-    def list_backups(self):
-        """List all available backups"""
-        backups = []
-        for item in os.listdir(self.backup_dir):
-            backup_path = os.path.join(self.backup_dir, item)
-            if os.path.isdir(backup_path):
-                metadata_file = os.path.join(backup_path, 'metadata.json')
-                if os.path.exists(metadata_file):
-                    with open(metadata_file, 'r') as f:
-                        metadata = json.load(f)
-                    backups.append({
-                        'path': backup_path,
-                        'timestamp': metadata['timestamp'],
-                        'items': metadata['items']
-                    })
-        
-        return sorted(backups, key=lambda x: x['timestamp'], reverse=True)
+    def _describe_files(self, backup_path):
+        """Return the size and checksum of each file of a backup"""
+        names = [name for name in self.BACKUP_FILES if os.path.exists(os.path.join(backup_path, name))]
+        with ThreadPoolExecutor(max_workers=self.verify_workers) as executor:
+            checksums = executor.map(file_checksum, [os.path.join(backup_path, name) for name in names])
+            return {
+                name: {'bytes': os.path.getsize(os.path.join(backup_path, name)), 'sha256': checksum}
+                for name, checksum in zip(names, checksums)
+            }
+    
+    def _check_file(self, backup_path, name, expected):
+        path = os.path.join(backup_path, name)
+        if not os.path.exists(path):
+            return [f"{name} is missing"]
+        if os.path.getsize(path) != expected['bytes']:
+            return [f"{name} has {os.path.getsize(path)} bytes, expected {expected['bytes']}"]
+        if file_checksum(path) != expected['sha256']:
+            return [f"{name} does not match its checksum"]
+        return []
+    
+    def _check_sqlite(self, path):
+        """Run SQLite's own consistency check on a database copy"""
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            result = [row[0] for row in connection.execute("PRAGMA quick_check")]
+        except sqlite3.DatabaseError as e:
+            return [f"database.db is not a valid database: {e}"]
+        finally:
+            connection.close()
+        return [] if result == ['ok'] else [f"database.db: {message}" for message in result]
+    
+    def _test_restore(self, backup_path, metadata):
+        """Restore a backup into a scratch database and compare it with the source
+        
+        Row counts must match the metadata. A sample of items is compared with
+        the backup's database copy (or the live database for non-SQLite
+        deployments) where the item is unchanged since, and must decrypt.
+        """
+        problems = []
+        users, items = self._load_snapshot(backup_path)
+        for name, rows in (('users', users), ('encrypted_data', items)):
+            if len(rows) != metadata['items'][name]:
+                problems.append(f"{name}.json has {len(rows)} rows, expected {metadata['items'][name]}")
+        
+        sample_ids = random.sample(sorted(items), min(self.verify_sample_size, len(items)))
+        with tempfile.TemporaryDirectory(prefix='verify_') as scratch_dir:
+            engine = create_engine('sqlite:///' + os.path.join(scratch_dir, 'restore.db'))
+            try:
+                db.metadata.create_all(engine, tables=[User.__table__, EncryptedData.__table__])
+                with engine.begin() as connection:
+                    if users:
+                        connection.execute(insert(User.__table__), [_decode_row(User.__table__, row) for row in users.values()])
+                    if items:
+                        connection.execute(insert(EncryptedData.__table__),
+                                           [_decode_row(EncryptedData.__table__, row) for row in items.values()])
+                with engine.connect() as connection:
+                    for name, table in (('users', User.__table__), ('encrypted_data', EncryptedData.__table__)):
+                        count = connection.execute(select(func.count()).select_from(table)).scalar()
+                        if count != metadata['items'][name]:
+                            problems.append(f"Restored {count} {name} rows, expected {metadata['items'][name]}")
+                    restored = self._sample_items(connection, sample_ids)
+            finally:
+                engine.dispose()
+        
+        source_db = os.path.join(backup_path, 'database.db')
+        source_engine = create_engine('sqlite:///' + source_db) if os.path.exists(source_db) else self.read_engine
+        try:
+            with source_engine.connect() as connection:
+                source = self._sample_items(connection, sample_ids)
+        except SQLAlchemyError as e:
+            problems.append(f"Could not read the source items: {getattr(e, 'orig', None) or e}")
+            source = {}
+        finally:
+            if source_engine is not self.read_engine:
+                source_engine.dispose()
+        
+        for data_id in sample_ids:
+            item = restored.get(data_id)
+            if item is None:
+                problems.append(f"Item {data_id} is missing after the restore")
+                continue
+            original = source.get(data_id)
+            # Only items unchanged since the snapshot can be compared
+            if original is not None and original.updated_at == item.updated_at \
+                    and original.encrypted_content != item.encrypted_content:
+                problems.append(f"Item {data_id} differs from the source")
+            try:
+                decrypt_value(item.encrypted_content)
+            except Exception:
+                problems.append(f"Item {data_id} cannot be decrypted with the current key")
+        return problems
+    
+    def _sample_items(self, connection, data_ids):
+        table = EncryptedData.__table__
+        rows = connection.execute(
+            select(table.c.id, table.c.updated_at, table.c.encrypted_content).where(table.c.id.in_(data_ids))
+        )
+        return {row.id: row for row in rows}
+    
+    def _snapshot_time(self, backup):
+        """Return when the data of a catalog entry was exported"""
+        metadata_file = os.path.join(backup['path'], 'metadata.json')
+        if os.path.exists(metadata_file):
+            with open(metadata_file, 'r') as f:
+                snapshot_time = json.load(f).get('snapshot_time')
+            if snapshot_time is not None:
+                return snapshot_time
+        # Backups from before the journal, the timestamp is taken before the export
+        return datetime.strptime(backup['timestamp'], TIMESTAMP_FORMAT).timestamp()
+    
+    def _load_snapshot(self, backup_path):
+        """Return the users and items of a backup as dicts by id"""
+        users, items = {}, {}
+        users_file = os.path.join(backup_path, 'users.json')
+        if os.path.exists(users_file):
+            with open(users_file, 'r') as f:
+                users = {row['id']: row for row in json.load(f)}
+        data_file = os.path.join(backup_path, 'encrypted_data.json')
+        if os.path.exists(data_file):
+            with open(data_file, 'r') as f:
+                items = {row['id']: row for row in json.load(f)}
+        return users, items
+    
+    def _replace_all(self, session, users, items):
+        """Replace every user and item, keeping their ids
+        
+        Returns the journal records of the change, to append once committed.
+        """
+        session.query(SearchIndex).delete()
+        session.query(VaultStats).delete()
+        # Import progress refers to the replaced vaults, and the users are deleted
+        session.query(VaultTransfer).delete()
+        session.query(EncryptedData).delete()
+        session.query(User).delete()
+        
+        user_rows = [_decode_row(User.__table__, row) for row in users.values()]
+        item_rows = [_decode_row(EncryptedData.__table__, row) for row in items.values()]
+        if user_rows:
+            session.execute(insert(User.__table__), user_rows)
+        if item_rows:
+            session.execute(insert(EncryptedData.__table__), item_rows)
+        
+        records = [{'op': 'reset'}]
+        records.extend(_insert_record(User.__table__, values) for values in user_rows)
+        records.extend(_insert_record(EncryptedData.__table__, values) for values in item_rows)
+        return records
+    
+    def _replace_scope(self, session, scope, users, items, user_id=None):
+        """Replace the items matching scope, inserting the given users if missing
+        
+        Existing users are left as they are, recovering a vault must not
+        revert credentials changed since. With user_id, the progress of that
+        user's imports is dropped with the vault. An item whose id has since
+        been reused by another user's item is recovered under a new id.
+        Returns the journal records of the change.
+        """
+        records = []
+        if user_id is not None:
+            session.query(VaultTransfer).filter_by(user_id=user_id).delete(synchronize_session=False)
+        current = session.query(EncryptedData.id, EncryptedData.user_id).filter(scope).all()
+        affected_users = {row.user_id for row in current}
+        if current:
+            current_ids = [row.id for row in current]
+            session.query(SearchIndex).filter(SearchIndex.data_id.in_(current_ids)).delete(synchronize_session=False)
+            session.query(EncryptedData).filter(EncryptedData.id.in_(current_ids)).delete(synchronize_session=False)
+            records.extend({'op': 'd', 'tbl': EncryptedData.__tablename__, 'row': {'id': row.id, 'user_id': row.user_id}}
+                           for row in current)
+        
+        for row in users.values():
+            values = _decode_row(User.__table__, row)
+            if session.query(User.id).filter_by(id=values['id']).first() is None:
+                session.execute(insert(User.__table__), [values])
+                records.append(_insert_record(User.__table__, values))
+        
+        item_rows = [_decode_row(EncryptedData.__table__, row) for row in items.values()]
+        taken = set()
+        if item_rows:
+            taken = {row.id for row in session.query(EncryptedData.id).filter(
+                EncryptedData.id.in_([values['id'] for values in item_rows]))}
+        for values in item_rows:
+            if values['id'] in taken:
+                del values['id']
+                values['id'] = session.execute(insert(EncryptedData.__table__).values(**values)).inserted_primary_key[0]
+        bulk_rows = [values for values in item_rows if values['id'] not in taken]
+        if bulk_rows:
+            session.execute(insert(EncryptedData.__table__), bulk_rows)
+        records.extend(_insert_record(EncryptedData.__table__, values) for values in item_rows)
+        
+        affected_users.update(values['user_id'] for values in item_rows)
+        search_index.rebuild_index(session, data_ids=[values['id'] for values in item_rows])
+        vault_stats.rebuild_stats(session, affected_users)
+        vault_cache.bump_vault_version(session, affected_users)
+        return records
+    
+    def list_backups(self, limit=None, offset=0):
+        """List available backups from the catalog, newest first"""
+        return self.catalog.list(limit=limit, offset=offset)
+    
+    def count_backups(self):
+        """Return the number of available backups"""
+        return self.catalog.count()
+    
+    def last_backup_time(self):
+        """Return when the data of the newest backup was exported, None without backups"""
+        backups = self.catalog.list(limit=1)
+        return self._snapshot_time(backups[0]) if backups else None
     
     def delete_backup(self, backup_path):
         """Delete a backup"""
         if not os.path.exists(backup_path):
             raise ValueError(f"Backup path does not exist: {backup_path}")
         
-        shutil.rmtree(backup_path) 
\ No newline at end of file
+        shutil.rmtree(backup_path)
+        self.catalog.remove(backup_path)
+    
+    def apply_retention(self, keep_hourly, keep_daily, keep_weekly):
+        """Delete the backups the grandfather-father-son policy no longer keeps"""
+        expired = select_expired(self.catalog.list(), keep_hourly, keep_daily, keep_weekly)
+        for backup in expired:
+            if os.path.exists(backup['path']):
+                shutil.rmtree(backup['path'])
+            self.catalog.remove(backup['path'])
+        
+        # Journal segments older than the oldest remaining backup can no longer be replayed
+        remaining = self.catalog.list()
+        if self.journal_dir and remaining:
+            prune_segments(self.journal_dir, self._snapshot_time(remaining[-1]))
+        return [backup['path'] for backup in expired] 
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""Build fingerprinted static assets
+
+Usage: python build_assets.py
+
+Copies every file under static/ (except static/dist) to static/dist with a
+content hash in its name, rewrites url() references in CSS to the
+fingerprinted names, writes gzip and (when the brotli package is installed)
+brotli variants of compressible files, and records the mapping in
+static/dist/manifest.json for the asset_url() template helper.
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_FILE = 'manifest.json'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ttf', '.json', '.txt'}
+CSS_URL = re.compile(r"url\((['\"]?)([^'\")]+)\1\)")
+SOURCE_MAP = re.compile(rb"\n?/[*/]# sourceMappingURL=[^\n]*")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def source_files():
+    """Yield the logical paths of all source assets, relative to static/"""
+    for root, dirs, files in os.walk(STATIC_DIR):
+        if os.path.abspath(root) == STATIC_DIR and 'dist' in dirs:
+            dirs.remove('dist')
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), STATIC_DIR)
+            yield path.replace(os.sep, '/')
+
+
+def fingerprint(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = posixpath.splitext(path)
+    return f"{stem}.{digest}{ext}"
+
+
+def rewrite_css(path, content, manifest):
+    """Point url() references of a stylesheet at fingerprinted files"""
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        target, suffix = re.match(r"([^?#]*)(.*)", url).groups()
+        if not target or ':' in target or target.startswith('/'):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(directory, target))
+        if resolved not in manifest:
+            return match.group(0)
+        rewritten = posixpath.relpath(manifest[resolved], directory or '.')
+        return f"url({quote}{rewritten}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def write_variants(target, content):
+    """Write the file and its precompressed variants"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+    if os.path.splitext(target)[1] not in COMPRESSIBLE:
+        return
+    with open(target + '.gz', 'wb') as f:
+        # A fixed mtime keeps rebuilds byte for byte identical
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(target + '.br', 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+
+def build():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+
+    # Stylesheets reference other assets, so fingerprint everything else first
+    paths = sorted(source_files(), key=lambda path: (path.endswith('.css'), path))
+    manifest = {}
+    for path in paths:
+        with open(os.path.join(STATIC_DIR, path), 'rb') as f:
+            content = f.read()
+        # Source maps are not shipped
+        if path.endswith(('.css', '.js')):
+            content = SOURCE_MAP.sub(b'', content)
+        if path.endswith('.css'):
+            content = rewrite_css(path, content, manifest)
+
+        manifest[path] = fingerprint(path, content)
+        write_variants(os.path.join(DIST_DIR, manifest[path]), content)
+
+    with open(os.path.join(DIST_DIR, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def main():
+    manifest = build()
+    print(f"Built {len(manifest)} assets into {DIST_DIR}")
+    if brotli is None:
+        print("brotli is not installed, only gzip variants were written")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
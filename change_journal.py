@@ -0,0 +1,255 @@
+import gzip
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+# Sessions writing to the local database set this key in their info
+JOURNAL_INFO_KEY = 'journal'
+JOURNALED_TABLES = ('users', 'encrypted_data')
+
+# Cache metadata rather than vault content, changes to them are not journaled
+EXCLUDED_COLUMNS = {'vault_version', 'vault_updated_at'}
+
+SEGMENT_SUFFIX = '.ndjson'
+
+# Active segments untouched this long belong to processes that are gone
+ORPHAN_AGE = 86400
+
+# Set by ChangeJournal.init_app
+_journal = None
+_listening = False
+
+
+def journaled_columns(table):
+    return [column for column in table.columns if column.name not in EXCLUDED_COLUMNS]
+
+
+def encode_row(table, values):
+    """Return the JSON representation of a row's journaled columns"""
+    row = {}
+    for column in journaled_columns(table):
+        value = values.get(column.name)
+        row[column.name] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+class ChangeJournal:
+    """Append-only journal of User and EncryptedData changes
+
+    Every committed insert, update and delete of a journaled session is
+    appended as one compact JSON line holding the row's ciphertext, so no
+    plaintext ever reaches the journal. Each process writes its own segment
+    file in JOURNAL_DIR, rotated after JOURNAL_SEGMENT_BYTES or
+    JOURNAL_SEGMENT_SECONDS and gzipped once closed. Together with the
+    backups this allows point-in-time recovery, see BackupManager.recover.
+    """
+
+    def __init__(self):
+        self.journal_dir = None
+        self.segment_bytes = 0
+        self.segment_seconds = 0
+        self.lock = threading.Lock()
+        self.file = None
+        self.pid = None
+        self.segment_path = None
+        self.segment_started = 0.0
+
+    def init_app(self, app):
+        global _journal, _listening
+        if not app.config['JOURNAL_ENABLED']:
+            return
+        self.journal_dir = app.config['JOURNAL_DIR']
+        self.segment_bytes = app.config['JOURNAL_SEGMENT_BYTES']
+        self.segment_seconds = app.config['JOURNAL_SEGMENT_SECONDS']
+        _journal = self
+
+        if not _listening:
+            event.listen(Session, 'after_flush', _after_flush)
+            event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
+            event.listen(Session, 'after_commit', _after_commit)
+            _listening = True
+
+    def append(self, records):
+        """Append the records of one committed transaction"""
+        if not records or self.journal_dir is None:
+            return
+        now = time.time()
+        lines = ''.join(
+            json.dumps(dict(record, t=record.get('t', now)), separators=(',', ':')) + '\n'
+            for record in records
+        )
+        with self.lock:
+            if (self.file is None or self.pid != os.getpid()
+                    or self.file.tell() >= self.segment_bytes
+                    or now - self.segment_started >= self.segment_seconds):
+                self._rotate(now)
+            self.file.write(lines)
+            self.file.flush()
+
+    def _rotate(self, now):
+        """Close the active segment of this process and start a new one"""
+        if self.file is not None and self.pid == os.getpid():
+            self.file.close()
+            # The end time in the name lets readers skip the segment
+            closed_path = os.path.join(self.journal_dir, f"{int(self.segment_started * 1000)}-{int(now * 1000)}-{self.pid}{SEGMENT_SUFFIX}")
+            try:
+                os.replace(self.segment_path, closed_path)
+            except FileNotFoundError:
+                # Pruned while idle, it only held records older than every backup
+                pass
+            else:
+                threading.Thread(target=compress_segment, args=(closed_path,), daemon=True).start()
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.pid = os.getpid()
+        self.segment_started = now
+        self.segment_path = os.path.join(self.journal_dir, f"{int(now * 1000)}-{self.pid}{SEGMENT_SUFFIX}")
+        self.file = open(self.segment_path, 'a', encoding='utf-8')
+
+
+def compress_segment(path):
+    """Gzip a closed segment, replacing the plain file"""
+    tmp_path = path + '.gz.tmp'
+    with open(path, 'rb') as source, gzip.open(tmp_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.replace(tmp_path, path + '.gz')
+    os.remove(path)
+
+
+def _record(op, obj):
+    table = obj.__table__
+    if op == 'd':
+        row = {'id': obj.id}
+        if 'user_id' in table.c:
+            row['user_id'] = obj.user_id
+    else:
+        row = encode_row(table, {column.name: getattr(obj, column.key)
+                                 for column in journaled_columns(table)})
+    return {'op': op, 'tbl': table.name, 'row': row}
+
+
+def _content_modified(obj):
+    state = inspect(obj)
+    return any(state.attrs[attr.key].history.has_changes()
+               for attr in state.mapper.column_attrs if attr.key not in EXCLUDED_COLUMNS)
+
+
+def _journaled(obj):
+    return getattr(obj, '__tablename__', None) in JOURNALED_TABLES
+
+
+def _after_flush(session, flush_context):
+    if _journal is None or not session.info.get(JOURNAL_INFO_KEY):
+        return
+    # Tagged with the innermost transaction so rolled back savepoints can be dropped
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    pending = session.info.setdefault('journal_pending', [])
+    pending.extend((transaction, _record('i', obj)) for obj in session.new if _journaled(obj))
+    pending.extend((transaction, _record('u', obj)) for obj in session.dirty
+                   if _journaled(obj) and _content_modified(obj))
+    pending.extend((transaction, _record('d', obj)) for obj in session.deleted if _journaled(obj))
+
+
+def _within(transaction, ancestor):
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _after_soft_rollback(session, previous_transaction):
+    pending = session.info.get('journal_pending')
+    if pending:
+        session.info['journal_pending'] = [(transaction, record) for transaction, record in pending
+                                           if not _within(transaction, previous_transaction)]
+
+
+def _after_commit(session):
+    # Also called when a savepoint is released, only the outer commit is durable
+    if session.get_nested_transaction() is not None:
+        return
+    pending = session.info.pop('journal_pending', None)
+    if pending and _journal is not None:
+        _journal.append([record for transaction, record in pending])
+
+
+def _segments(journal_dir):
+    """Yield (start, end, active, path) of the segments
+
+    The end of an active segment is its modification time, no record in it
+    is newer than that.
+    """
+    if not journal_dir or not os.path.isdir(journal_dir):
+        return
+    names = set(os.listdir(journal_dir))
+    for name in names:
+        if name.endswith(SEGMENT_SUFFIX + '.gz'):
+            # Being compressed, the plain file is still complete
+            if name[:-3] in names:
+                continue
+            stem = name[:-len(SEGMENT_SUFFIX) - 3]
+        elif name.endswith(SEGMENT_SUFFIX):
+            stem = name[:-len(SEGMENT_SUFFIX)]
+        else:
+            continue
+        parts = stem.split('-')
+        path = os.path.join(journal_dir, name)
+        if len(parts) == 3:
+            yield int(parts[0]) / 1000, int(parts[1]) / 1000, False, path
+        elif len(parts) == 2:
+            yield int(parts[0]) / 1000, os.path.getmtime(path), True, path
+
+
+def _open_segment(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    try:
+        return open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        # Compressed since the directory was listed
+        return gzip.open(path + '.gz', 'rt', encoding='utf-8')
+
+
+def _read_segment(path, since, until):
+    with _open_segment(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line still being written by another process
+                continue
+            if (since is None or record['t'] > since) and (until is None or record['t'] <= until):
+                yield record
+
+
+def read_records(journal_dir, since=None, until=None):
+    """Yield the journal records with since < t <= until, oldest first"""
+    readers = []
+    for start, end, active, path in _segments(journal_dir):
+        if until is not None and start > until:
+            continue
+        if since is not None and end < since:
+            continue
+        readers.append(_read_segment(path, since, until))
+    # Every segment is in time order, merge those of all processes
+    return heapq.merge(*readers, key=lambda record: record['t'])
+
+
+def prune_segments(journal_dir, before):
+    """Delete the segments holding only records older than before"""
+    removed = 0
+    for start, end, active, path in list(_segments(journal_dir)):
+        # A live process rotates its active segment before writing again
+        if active and end > time.time() - ORPHAN_AGE:
+            continue
+        if end < before:
+            os.remove(path)
+            removed += 1
+    return removed
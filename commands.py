@@ -0,0 +1,132 @@
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+from extensions import db
+from managers import get_backup_manager, get_database_manager
+import vault_transfer
+
+
+def register_commands(app):
+    """Register the application's flask CLI commands"""
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Rebuild the blind search index for all stored items"""
+        import search_index
+        count = search_index.rebuild_index(db.session)
+        db.session.commit()
+        click.echo(f"Indexed {count} items")
+
+    @app.cli.command('rebuild-vault-stats')
+    def rebuild_vault_stats():
+        """Recompute the rollups behind the admin statistics"""
+        import vault_stats
+        vault_stats.rebuild_stats(db.session)
+        db.session.commit()
+        click.echo("Rebuilt the vault statistics")
+
+    @app.cli.command('rebuild-backup-catalog')
+    def rebuild_backup_catalog():
+        """Rebuild the backup catalog from the backup directory"""
+        count = get_backup_manager(app).catalog.rebuild()
+        click.echo(f"Cataloged {count} backups")
+
+    @app.cli.command('recover')
+    @click.option('--to', 'target', required=True, help='Point in time, e.g. "2024-05-01 13:30:00" (local time)')
+    @click.option('--user-id', type=int, help='Only recover the items of this user')
+    @click.option('--item-id', type=int, help='Only recover this item')
+    def recover(target, user_id, item_id):
+        """Recover the vaults as they were at a point in time"""
+        if user_id is not None and item_id is not None:
+            raise click.UsageError("Pass either --user-id or --item-id")
+        try:
+            target_time = datetime.fromisoformat(target)
+        except ValueError:
+            raise click.BadParameter(f"Not a date and time: {target}", param_hint='--to')
+        try:
+            count = get_backup_manager(app).recover(target_time, user_id=user_id, data_id=item_id)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Recovered {count} items as of {target_time}")
+
+    @app.cli.command('verify-backups')
+    @click.option('--all', 'verify_all', is_flag=True, help='Verify every backup, not only unverified ones')
+    def verify_backups(verify_all):
+        """Check backup checksums and test-restore them"""
+        backup_manager = get_backup_manager(app)
+        backups = backup_manager.list_backups() if verify_all else backup_manager.catalog.list_unverified()
+        failed = 0
+        for backup in backups:
+            problems = backup_manager.verify_backup(backup['path'])
+            if problems:
+                failed += 1
+                click.echo(f"{backup['path']}: FAILED")
+                for problem in problems:
+                    click.echo(f"  {problem}")
+            else:
+                click.echo(f"{backup['path']}: ok")
+        click.echo(f"Verified {len(backups)} backups, {failed} failed")
+        if failed:
+            raise SystemExit(1)
+
+    vault = AppGroup('vault', help='Import and export vault items.')
+
+    def vault_user(username):
+        if not app.config['ENCRYPTION_KEY']:
+            # Without it the items would be encrypted with a throwaway key
+            raise click.ClickException("ENCRYPTION_KEY is not set")
+        user = get_database_manager(app).get_user(username)
+        if user is None:
+            raise click.ClickException(f"No user named {username}")
+        return user
+
+    def report_progress(label):
+        def progress(done, total):
+            click.echo(f"\r{label} {done}" + (f"/{total}" if total is not None else ''), err=True, nl=False)
+        return progress
+
+    @vault.command('import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--user', 'username', required=True, help='Owner of the imported items')
+    @click.option('--format', 'fmt', type=click.Choice(vault_transfer.FORMATS), help='Defaults to the file extension')
+    @click.option('--data-type', default='note', show_default=True, help='Type of records without one')
+    @click.option('--batch-size', default=500, show_default=True, help='Records per transaction')
+    @click.option('--workers', type=int, help='Encryption processes, defaults to the CPU count')
+    @click.option('--restart', is_flag=True, help='Start over instead of resuming an interrupted import')
+    def import_vault(path, username, fmt, data_type, batch_size, workers, restart):
+        """Import a CSV or NDJSON file of items into a user's vault"""
+        user = vault_user(username)
+        try:
+            imported, rejected = vault_transfer.import_vault(
+                get_database_manager(app), user.id, path, app.config['ENCRYPTION_KEY'], fmt=fmt,
+                default_type=data_type, batch_size=batch_size, workers=workers, restart=restart,
+                progress=report_progress('Records')
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(err=True)
+        click.echo(f"Imported {imported} items, skipped {rejected} invalid records")
+
+    @vault.command('export')
+    @click.argument('path')
+    @click.option('--user', 'username', required=True, help='Owner of the exported items')
+    @click.option('--format', 'fmt', type=click.Choice(vault_transfer.FORMATS), help='Defaults to the file extension')
+    @click.option('--batch-size', default=500, show_default=True, help='Items per query')
+    @click.option('--workers', type=int, help='Decryption processes, defaults to the CPU count')
+    @click.option('--resume', is_flag=True, help='Continue an interrupted export to the same file')
+    def export_vault(path, username, fmt, batch_size, workers, resume):
+        """Export a user's vault, decrypted, to a CSV or NDJSON file ('-' for stdout)"""
+        user = vault_user(username)
+        try:
+            count = vault_transfer.export_vault(
+                get_database_manager(app), user.id, path, app.config['ENCRYPTION_KEY'], fmt=fmt,
+                batch_size=batch_size, workers=workers, resume=resume,
+                progress=report_progress('Items') if path != '-' else None
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if path != '-':
+            click.echo(err=True)
+            click.echo(f"Exported {count} items to {path}")
+
+    app.cli.add_command(vault)
@@ -15,16 +15,77 @@ class Config:
     # Database configuration
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Group commit, writes of concurrent requests share one transaction (mainly for SQLite)
+    WRITE_COALESCING = os.getenv('WRITE_COALESCING', '0') == '1'
+    WRITE_COALESCE_WINDOW_MS = 2  # how long the writer waits for more writes to join a batch
+    WRITE_COALESCE_MAX_BATCH = 64
+    WRITE_COALESCE_TIMEOUT = 30  # seconds a request waits for its write
+    
+    # Rendered dashboard fragments kept in memory, per process
+    FRAGMENT_CACHE_SIZE = 256
+    
     # Sync configuration
     SYNC_INTERVAL = 300  # 5 minutes
     
     # Backup configuration
     BACKUP_INTERVAL = 3600  # 1 hour
     BACKUP_DIR = 'backups'
+    BACKUPS_PER_PAGE = 20
+    
+    # Admin statistics, users with the largest vaults listed
+    ADMIN_STATS_TOP_USERS = 50
+    
+    # Backup retention, the newest backup of each of the last N hours, days and weeks is kept
+    BACKUP_RETENTION_INTERVAL = 3600  # 1 hour
+    BACKUP_KEEP_HOURLY = 24
+    BACKUP_KEEP_DAILY = 7
+    BACKUP_KEEP_WEEKLY = 4
+    
+    # Backup verification, a heavy job checking one unverified backup per run
+    BACKUP_VERIFY_INTERVAL = 600  # 10 minutes
+    BACKUP_VERIFY_WORKERS = 2  # threads hashing files and test-restoring
+    BACKUP_VERIFY_SAMPLE = 100  # items compared with the source
+    
+    # Change journal, replayed on top of a backup for point-in-time recovery
+    JOURNAL_ENABLED = os.getenv('JOURNAL_ENABLED', '1') == '1'
+    JOURNAL_DIR = os.getenv('JOURNAL_DIR', os.path.join(BASE_DIR, 'journal'))
+    JOURNAL_SEGMENT_BYTES = 16 * 1024 * 1024
+    JOURNAL_SEGMENT_SECONDS = 3600  # 1 hour
+    
+    # Worker configuration, only the worker holding the lock runs sync and backups
+    WORKER_LOCK_FILE = os.getenv('WORKER_LOCK_FILE', os.path.join(BASE_DIR, 'worker.lock'))
+    WORKER_STANDBY_INTERVAL = 15  # seconds between leadership checks
+    
+    # Scheduler configuration
+    MAINTENANCE_INTERVAL = 86400  # 1 day
+    SCHEDULER_JITTER = 0.1  # +/- 10% of each interval
+    SCHEDULER_RETRY_DELAY = 60  # first retry after a failure, doubled on each failure
+    SCHEDULER_MAX_BACKOFF = 3600
+    SCHEDULER_STOP_TIMEOUT = 10  # seconds a shutdown waits for running jobs
+    
+    # Load awareness, heavy jobs are deferred while the web processes are busy
+    LOAD_STATE_DIR = os.getenv('LOAD_STATE_DIR', os.path.join(BASE_DIR, 'load_state'))
+    LOAD_MAX_LATENCY_MS = 500
+    LOAD_MAX_IN_FLIGHT = 8
+    LOAD_DEFER_INTERVAL = 30
+    LOAD_MAX_DEFER = 1800  # run heavy jobs anyway after being deferred this long
+    
+    # Request profiling, opt-in as it adds overhead to every request
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+    SLOW_QUERY_MS = 100
+    N_PLUS_ONE_THRESHOLD = 5  # same statement executed this often in one request
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # fraction of requests to profile
+    PROFILER = os.getenv('PROFILER', 'cprofile')  # 'cprofile' or 'pyinstrument'
+    PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+    PROFILE_KEEP = 100  # newest profiles kept, 0 disables saving them
     
     # Local SQLite database
     SQLALCHEMY_DATABASE_URI = os.getenv('LOCAL_DATABASE_URL', 'sqlite:///secure_db.sqlite')
     
+    # Read replicas (comma separated URLs) for read-only views, backup exports and sync scans
+    DATABASE_REPLICA_URLS = os.getenv('DATABASE_REPLICA_URLS', '')
+    REPLICA_STICKY_SECONDS = 10  # a client reads from the primary this long after its own write
+    
     # Cloud PostgreSQL database
     CLOUD_DATABASE_URL = os.getenv('CLOUD_DATABASE_URL')
     
@@ -39,7 +100,7 @@ class DevelopmentConfig(Config):
     DEBUG = True
     # Use BASE_DIR to specify the database path in the project root and use the correct SQLite URL format
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(Config.BASE_DIR, 'dev.db')
-    CLOUD_DATABASE_URI = None
+    CLOUD_DATABASE_URL = None
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -52,8 +113,8 @@ class ProductionConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
-    CLOUD_DATABASE_URI = None
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite:///test.db')
+    CLOUD_DATABASE_URL = None
     
     # Testing-specific settings
     SYNC_INTERVAL = 10  # 10 seconds
@@ -3,40 +3,43 @@ from extensions import db
 # from models import User # We will import this inside the context
 from werkzeug.security import generate_password_hash
 
+def create_user(username, password, email, is_admin=False):
+    """Adds a user unless the username is taken, returns True if it was added.
+
+    Must be called within an application context; the caller commits.
+    """
+    # Import models inside the context to ensure they are registered with db
+    from models import User
+
+    # Check if the user already exists to avoid duplicates
+    if User.query.filter_by(username=username).first() is not None:
+        return False
+
+    user = User(
+        username=username,
+        password_hash=generate_password_hash(password),
+        email=email,
+        is_admin=is_admin
+    )
+    db.session.add(user)
+    return True
+
 def create_initial_users():
     """Creates database tables and adds initial users."""
     with app.app_context():
-        # Import models inside the context to ensure they are registered with db
-        from models import User
-
         # Create all tables if they don't exist - REMOVED, schema is managed by migrations
         # db.create_all()
 
-        # Check if users already exist to avoid duplicates
-        if User.query.filter_by(username='testuser').first() is None:
-            # Create a regular user
-            test_user = User(
-                username='testuser',
-                password_hash=generate_password_hash('password'),
-                email='testuser@example.com',
-                is_admin=False
-            )
-            db.session.add(test_user)
+        # Create a regular user
+        if create_user('testuser', 'password', 'testuser@example.com'):
             print("Created user: testuser")
 
-        if User.query.filter_by(username='admin').first() is None:
-            # Create an admin user
-            admin_user = User(
-                username='admin',
-                password_hash=generate_password_hash('adminpassword'),
-                email='admin@example.com',
-                is_admin=True
-            )
-            db.session.add(admin_user)
+        # Create an admin user
+        if create_user('admin', 'adminpassword', 'admin@example.com', is_admin=True):
             print("Created admin user: admin")
 
         db.session.commit()
         print("Initial users added to the database.")
 
 if __name__ == '__main__':
-    create_initial_users() 
\ No newline at end of file
+    create_initial_users()
\ No newline at end of file
@@ -1,15 +1,22 @@
+from datetime import datetime
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-import bcrypt
-from models import User, EncryptedData, init_db
+from extensions import LOCAL_SESSION_INFO
+from models import User, EncryptedData, SearchIndex, VaultTransfer, encrypt_value
+import search_index
+import vault_cache
+import vault_writes
 
 class DatabaseManager:
     def __init__(self, database_url="sqlite:///secure_db.sqlite"):
-        self.engine = init_db(database_url)
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine = create_engine(database_url)
+        # Changes are journaled and counted in the statistics like those of the app
+        self.Session = sessionmaker(bind=self.engine, info=dict(LOCAL_SESSION_INFO))
     
     def create_user(self, username, password, email):
         """Create a new user with hashed password"""
+        import bcrypt
         try:
             session = self.Session()
             # Hash the password
@@ -32,6 +39,7 @@ class DatabaseManager:
     
     def verify_user(self, username, password):
         """Verify user credentials"""
+        import bcrypt
         try:
             session = self.Session()
             user = session.query(User).filter_by(username=username).first()
@@ -46,13 +54,9 @@ class DatabaseManager:
         """Store encrypted data for a user"""
         try:
             session = self.Session()
-            encrypted_data = EncryptedData(
-                user_id=user_id,
-                data_type=data_type
-            )
-            encrypted_data.encrypted_content = encrypted_data.encrypt_content(content)
-            
-            session.add(encrypted_data)
+            # Indexed and versioned like the items stored through the app
+            data_id = vault_writes.add_item(session, user_id, data_type, encrypt_value(content), None, [])
+            encrypted_data = session.get(EncryptedData, data_id)
             session.commit()
             return encrypted_data
         except SQLAlchemyError as e:
@@ -80,10 +84,13 @@ class DatabaseManager:
         """Update encrypted data"""
         try:
             session = self.Session()
-            data = session.query(EncryptedData).get(data_id)
+            data = session.get(EncryptedData, data_id)
             
             if data:
-                data.encrypted_content = data.encrypt_content(new_content)
+                # Keeps the type and tags, reindexes and bumps the vault version
+                tags = data.decrypted_tags
+                vault_writes.update_item(session, data.user_id, data_id, data.data_type,
+                                         data.encrypt_content(new_content), data.encrypted_tags, tags)
                 session.commit()
                 return True
             return False
@@ -97,10 +104,10 @@ class DatabaseManager:
         """Delete encrypted data"""
         try:
             session = self.Session()
-            data = session.query(EncryptedData).get(data_id)
+            data = session.get(EncryptedData, data_id)
             
             if data:
-                session.delete(data)
+                vault_writes.delete_item(session, data.user_id, data_id)
                 session.commit()
                 return True
             return False
@@ -108,4 +115,120 @@ class DatabaseManager:
             session.rollback()
             raise e
         finally:
-            session.close() 
\ No newline at end of file
+            session.close() 
+    
+    def get_user(self, username):
+        """Return a user by username, or None"""
+        session = self.Session()
+        try:
+            return session.query(User).filter_by(username=username).first()
+        finally:
+            session.close()
+    
+    def start_transfer(self, user_id, source, fingerprint, restart=False):
+        """Return the id and progress of the import of a file into a user's vault
+        
+        An interrupted import of the same file is resumed unless restart is
+        set; importing a file that was imported completely is refused.
+        """
+        session = self.Session()
+        try:
+            transfer = session.query(VaultTransfer).filter_by(
+                user_id=user_id, fingerprint=fingerprint
+            ).order_by(VaultTransfer.id.desc()).first()
+            if transfer is not None and not restart:
+                if transfer.status == 'done':
+                    raise ValueError(f"{source} was already imported for this user")
+                return transfer.id, transfer.rows_done
+            
+            transfer = VaultTransfer(user_id=user_id, source=source[-255:], fingerprint=fingerprint)
+            session.add(transfer)
+            session.commit()
+            return transfer.id, 0
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+    
+    def import_items(self, user_id, items, transfer_id, rows_done):
+        """Store a batch of encrypted items and the import's progress in one transaction
+        
+        Each item is a dict of data_type, encrypted_content, encrypted_tags and
+        the plain tags for the search index. As the progress commits with the
+        items, a resumed import never stores a row twice.
+        """
+        session = self.Session()
+        try:
+            objects = [EncryptedData(
+                user_id=user_id,
+                data_type=item['data_type'],
+                encrypted_content=item['encrypted_content'],
+                encrypted_tags=item['encrypted_tags']
+            ) for item in items]
+            session.add_all(objects)
+            session.flush() # Assign ids before indexing
+            
+            # New items have no index entries yet, so no need for index_item
+            session.add_all([
+                SearchIndex(user_id=user_id, data_id=data.id, token_hash=token)
+                for data, item in zip(objects, items)
+                for token in search_index.item_tokens(data.data_type, item['tags'])
+            ])
+            if objects:
+                vault_cache.bump_vault_version(session, [user_id])
+            session.query(VaultTransfer).filter_by(id=transfer_id).update(
+                {VaultTransfer.rows_done: rows_done, VaultTransfer.updated_at: datetime.utcnow()},
+                synchronize_session=False
+            )
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+    
+    def finish_transfer(self, transfer_id):
+        """Mark an import as complete"""
+        session = self.Session()
+        try:
+            session.query(VaultTransfer).filter_by(id=transfer_id).update(
+                {VaultTransfer.status: 'done', VaultTransfer.updated_at: datetime.utcnow()},
+                synchronize_session=False
+            )
+            session.commit()
+        finally:
+            session.close()
+    
+    def count_items(self, user_id, after_id=0):
+        """Count a user's items with an id above after_id"""
+        session = self.Session()
+        try:
+            return session.query(func.count(EncryptedData.id)).filter(
+                EncryptedData.user_id == user_id, EncryptedData.id > after_id
+            ).scalar()
+        finally:
+            session.close()
+    
+    def iter_items(self, user_id, after_id=0, batch_size=500):
+        """Yield a user's encrypted items in id order, one batch (list of rows) at a time
+        
+        Keyset pagination keeps every batch a short indexed query, however
+        large the vault.
+        """
+        session = self.Session()
+        try:
+            while True:
+                batch = session.query(
+                    EncryptedData.id, EncryptedData.data_type, EncryptedData.encrypted_content,
+                    EncryptedData.encrypted_tags, EncryptedData.created_at, EncryptedData.updated_at
+                ).filter(
+                    EncryptedData.user_id == user_id, EncryptedData.id > after_id
+                ).order_by(EncryptedData.id).limit(batch_size).all()
+                if not batch:
+                    return
+                yield batch
+                after_id = batch[-1].id
+                session.rollback() # Do not hold a read transaction between batches
+        finally:
+            session.close()
\ No newline at end of file
@@ -0,0 +1,77 @@
+import random
+import time
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Flask session key holding the time until which a client reads from the primary
+STICKY_KEY = '_primary_until'
+
+
+def replica_urls(config):
+    return [url.strip() for url in config['DATABASE_REPLICA_URLS'].split(',') if url.strip()]
+
+
+def replica_url(app):
+    """Return one of the configured replica URLs, or None without replicas"""
+    urls = replica_urls(app.config)
+    return random.choice(urls) if urls else None
+
+
+def read_only(view):
+    """Mark a view as safe to serve from a read replica"""
+    view.read_only = True
+    return view
+
+
+class RoutingSession(Session):
+    """Session sending the reads of read-only requests to a replica
+
+    Flushes and DML statements always go to the primary, so a read-only
+    view that writes anyway stays correct.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and has_app_context():
+            bind_key = g.get('replica_bind')
+            if bind_key is not None:
+                return self._db.engines[bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class DatabaseRouter:
+    """Route read-only requests to the replicas in DATABASE_REPLICA_URLS
+
+    Each replica becomes a Flask-SQLAlchemy bind, and every request of a
+    view marked @read_only picks one. A client that made a write (any
+    successful non-GET request) reads from the primary for the next
+    REPLICA_STICKY_SECONDS, so it sees its own writes despite replica lag.
+    init_app must run before db.init_app so the binds exist.
+    """
+
+    def __init__(self):
+        self.bind_keys = []
+        self.sticky_seconds = 0
+
+    def init_app(self, app):
+        urls = replica_urls(app.config)
+        if not urls:
+            return
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        self.bind_keys = []
+        for i, url in enumerate(urls):
+            binds[f'replica{i}'] = url
+            self.bind_keys.append(f'replica{i}')
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        if getattr(view, 'read_only', False) and session.get(STICKY_KEY, 0) <= time.time():
+            g.replica_bind = random.choice(self.bind_keys)
+
+    def _after_request(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            session[STICKY_KEY] = time.time() + self.sticky_seconds
+        return response
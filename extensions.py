@@ -1,3 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_login import LoginManager
+from assets import Assets
+from change_journal import ChangeJournal, JOURNAL_INFO_KEY
+from db_routing import DatabaseRouter, RoutingSession
+from load_monitor import LoadMonitor
+from fragment_cache import FragmentCache
+from profiling import Profiler
+from write_coalescer import WriteCoalescer
 
-db = SQLAlchemy() 
\ No newline at end of file
+# Session info key enabling the vault statistics rollups, see vault_stats
+STATS_INFO_KEY = 'vault_stats'
+
+# Info of every session writing the local database: its commits are recorded
+# in the change journal and its item writes update the statistics rollups
+LOCAL_SESSION_INFO = {JOURNAL_INFO_KEY: True, STATS_INFO_KEY: True}
+
+db = SQLAlchemy(session_options={
+    'class_': RoutingSession, # Reads of read-only views may go to a replica
+    'info': dict(LOCAL_SESSION_INFO)
+})
+db_router = DatabaseRouter()
+login_manager = LoginManager()
+load_monitor = LoadMonitor()
+fragment_cache = FragmentCache()
+assets = Assets()
+profiler = Profiler()
+write_coalescer = WriteCoalescer(db)
+change_journal = ChangeJournal()
\ No newline at end of file
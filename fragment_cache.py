@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """Bounded LRU cache of rendered page fragments
+
+    Entries are keyed by user, vault version and fragment name, so a write,
+    sync or restore that bumps the version makes older entries unreachable;
+    invalidate_user() frees them right away.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config['FRAGMENT_CACHE_SIZE']
+
+    def get_or_render(self, user, name, render):
+        """Return the cached fragment, rendering and storing it on a miss"""
+        key = (user.id, user.vault_version, name)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        fragment = render()
+        with self.lock:
+            self.entries[key] = fragment
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return fragment
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,81 @@
+"""Measure the cold import time of the application against a budget
+
+Usage: python import_budget.py [--module app] [--budget-ms 1000] [--runs 3]
+
+Runs `python -X importtime` in fresh interpreters, reports the slowest
+imports and fails if the median import time exceeds the budget or if a
+module that should be loaded lazily was imported.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported when they are first needed
+DEFERRED_MODULES = ['cryptography', 'alembic', 'flask_migrate', 'sync_manager', 'backup_manager']
+
+
+def measure(module):
+    """Import a module in a fresh interpreter and return its import timings
+
+    Returns a dict mapping each imported module to its cumulative time in
+    microseconds, a list of (self time, name) and the set of loaded modules.
+    """
+    code = f"import sys, {module}; print(','.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    cumulative = {}
+    self_times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        self_times.append((int(self_us), name.strip()))
+        cumulative[name.strip()] = int(cumulative_us)
+    loaded = set(result.stdout.strip().split(','))
+    return cumulative, self_times, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', 1000)))
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = [cumulative[args.module] / 1000 for cumulative, _, _ in runs]
+    flask_times = [cumulative.get('flask', 0) / 1000 for cumulative, _, _ in runs]
+    total_ms = statistics.median(totals)
+    flask_ms = statistics.median(flask_times)
+
+    print(f"Import of {args.module}: {total_ms:.1f} ms (median of {args.runs} runs)")
+    print(f"  flask: {flask_ms:.1f} ms ({flask_ms / total_ms:.0%})")
+    print("Slowest imports by self time:")
+    _, self_times, loaded = runs[-1]
+    for self_us, name in sorted(self_times, reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: {total_ms:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print(f"OK: within the budget of {args.budget_ms:.0f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import os
+import zlib
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+# Advisory lock id shared by every worker process of this application
+ADVISORY_LOCK_KEY = zlib.crc32(b'secure-db-worker-leader')
+
+
+def postgres_url(db_url):
+    """Return db_url as a Postgres URL SQLAlchemy can connect to, or None for other databases
+
+    Heroku style postgres:// URLs are accepted, SQLAlchemy only knows the
+    postgresql dialect name.
+    """
+    url = make_url(db_url)
+    backend, _, driver = url.drivername.partition('+')
+    if backend not in ('postgres', 'postgresql'):
+        return None
+    return url.set(drivername='postgresql' + ('+' + driver if driver else ''))
+
+
+class LeaderLock:
+    """Cross-process lock deciding which worker runs the background jobs
+
+    SQLite deployments live on a single machine, so an exclusive lock on a
+    file next to the application is enough. Postgres deployments may run
+    workers on several machines and use a session level advisory lock, which
+    the server releases automatically if the holder dies.
+    """
+
+    def __init__(self, db_url, lock_file):
+        self.db_url = postgres_url(db_url) or db_url
+        self.lock_file = lock_file
+        self.use_advisory_lock = postgres_url(db_url) is not None
+
+        self._file = None
+        self._engine = None
+        self._connection = None
+
+    @property
+    def is_held(self):
+        return self._file is not None or self._connection is not None
+
+    def acquire(self):
+        """Try to become the leader without blocking, return True on success"""
+        if self.is_held:
+            return True
+        if self.use_advisory_lock:
+            return self._acquire_advisory_lock()
+        return self._acquire_file_lock()
+
+    def release(self):
+        """Give up leadership"""
+        if self._file is not None:
+            try:
+                self._unlock_file(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+        if self._connection is not None:
+            try:
+                self._connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': ADVISORY_LOCK_KEY})
+            except Exception:
+                # The connection is gone, and the lock with it
+                pass
+            finally:
+                self._connection.close()
+                self._connection = None
+
+    def check(self):
+        """Return True while leadership is still held
+
+        An advisory lock only lives as long as its connection, so probe it.
+        """
+        if self._connection is not None:
+            try:
+                self._connection.execute(text("SELECT 1"))
+            except Exception:
+                self._connection.close()
+                self._connection = None
+                return False
+        return self.is_held
+
+    def _acquire_file_lock(self):
+        lock_dir = os.path.dirname(os.path.abspath(self.lock_file))
+        os.makedirs(lock_dir, exist_ok=True)
+
+        lock_file = open(self.lock_file, 'a+')
+        try:
+            self._lock_file(lock_file)
+        except OSError:
+            lock_file.close()
+            return False
+
+        # Record the leader for operators, the lock itself is what counts
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def _acquire_advisory_lock(self):
+        if self._engine is None:
+            self._engine = create_engine(self.db_url, pool_size=1, max_overflow=0)
+
+        connection = self._engine.connect()
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {'key': ADVISORY_LOCK_KEY}
+            ).scalar()
+            # Leave the implicit transaction, the lock is held by the session
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+
+        if not acquired:
+            connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    if os.name == 'nt':
+        @staticmethod
+        def _lock_file(lock_file):
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+        @staticmethod
+        def _unlock_file(lock_file):
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        @staticmethod
+        def _lock_file(lock_file):
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        @staticmethod
+        def _unlock_file(lock_file):
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
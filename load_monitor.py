@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from flask import g
+
+
+class LoadMonitor:
+    """Track in-flight requests and request latency of a web process
+
+    The numbers are published to a small file per process in state_dir so
+    the worker's scheduler, which runs in another process, can read them.
+    """
+
+    def __init__(self, state_dir=None, alpha=0.2, publish_interval=1.0):
+        self.state_dir = state_dir
+        self.alpha = alpha
+        self.publish_interval = publish_interval
+
+        self.in_flight = 0
+        self.latency_ms = 0.0
+        self.last_published = 0.0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """Register the request hooks on a Flask app"""
+        if self.state_dir is None:
+            self.state_dir = app.config['LOAD_STATE_DIR']
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def snapshot(self):
+        """Return (in-flight requests, smoothed latency in ms)"""
+        with self.lock:
+            return self.in_flight, self.latency_ms
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, duration):
+        """Record a finished request, duration is in seconds"""
+        with self.lock:
+            self.in_flight -= 1
+            # Exponentially weighted moving average of the latency
+            self.latency_ms += self.alpha * (duration * 1000 - self.latency_ms)
+            publish = time.monotonic() - self.last_published >= self.publish_interval
+            if publish:
+                self.last_published = time.monotonic()
+        if publish:
+            self.publish()
+
+    def publish(self):
+        """Write this process's load to the shared state directory"""
+        if not self.state_dir:
+            return
+        in_flight, latency_ms = self.snapshot()
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, f"{os.getpid()}.json")
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'in_flight': in_flight, 'latency_ms': latency_ms, 'time': time.time()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Load publish error: {e}")
+
+    def _before_request(self):
+        g.load_monitor_started = time.monotonic()
+        self.request_started()
+
+    def _teardown_request(self, exc):
+        started = g.pop('load_monitor_started', None)
+        if started is not None:
+            self.request_finished(time.monotonic() - started)
+
+
+def read_load(state_dir, max_age=30):
+    """Aggregate the load published by all web processes
+
+    Returns the total in-flight requests and the worst latency. Processes that
+    have not published for max_age seconds are idle or gone and are ignored.
+    """
+    in_flight = 0
+    latency_ms = 0.0
+    if not os.path.isdir(state_dir):
+        return in_flight, latency_ms
+
+    now = time.time()
+    for name in os.listdir(state_dir):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(state_dir, name)
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - state['time'] > max_age:
+            # Clean up after processes that are long gone
+            if now - state['time'] > max_age * 10:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            continue
+        in_flight += state['in_flight']
+        latency_ms = max(latency_ms, state['latency_ms'])
+    return in_flight, latency_ms
@@ -0,0 +1,244 @@
+"""Concurrent load test against the Waitress deployment
+
+Usage: python loadtest.py [--concurrency 16] [--duration 30] [--threads 8]
+
+Creates a scratch SQLite database, seeds users through the same path as
+create_initial_users.py, starts `waitress-serve app:app` on a local port
+and drives a mix of logins, dashboard views, item views, creates, edits and
+deletes from --concurrency virtual users. Reports throughput, p50/p95/p99
+latency, errors and SQLite lock timeouts (503 responses) per route.
+
+Pass --url to target a server that is already running; users are then
+seeded into the database configured for the current FLASK_ENV.
+"""
+import argparse
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from cryptography.fernet import Fernet
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+PASSWORD = 'loadtest-password'
+
+# Relative weights of the actions a virtual user picks from
+TRAFFIC_MIX = {
+    'dashboard': 40,
+    'view': 25,
+    'create': 15,
+    'edit': 10,
+    'delete': 5,
+    'login': 5,
+}
+
+ITEM_LINK = re.compile(r'/data/(\d+)"')
+
+
+class Results:
+    """Thread safe collection of request outcomes per route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_timeouts = defaultdict(int)
+
+    def record(self, route, started, response=None, error=None):
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.latencies[route].append(latency)
+            if response is not None and response.status_code == 503:
+                self.lock_timeouts[route] += 1
+            elif error is not None or response.status_code >= 400:
+                self.errors[route] += 1
+
+    def report(self, elapsed):
+        print(f"{'route':<12}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'errors':>8}{'locked':>8}")
+        total = 0
+        for route in TRAFFIC_MIX:
+            latencies = sorted(self.latencies.get(route, []))
+            if not latencies:
+                continue
+            total += len(latencies)
+            p50, p95, p99 = percentiles(latencies)
+            print(f"{route:<12}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}"
+                  f"{rate(self.errors[route], latencies):>8}{rate(self.lock_timeouts[route], latencies):>8}")
+        print(f"{'total':<12}{total:>10}{total / elapsed:>9.1f}")
+
+
+def percentiles(latencies):
+    """Return p50, p95 and p99 of a sorted list of latencies, in ms"""
+    if len(latencies) == 1:
+        return (latencies[0] * 1000,) * 3
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000
+
+
+def rate(count, latencies):
+    return f"{count / len(latencies):.1%}"
+
+
+class VirtualUser:
+    """One simulated browser session"""
+
+    def __init__(self, base_url, username, results):
+        self.base_url = base_url
+        self.username = username
+        self.results = results
+        self.session = requests.Session()
+        self.item_ids = []
+
+    def request(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, timeout=30, **kwargs)
+        except requests.RequestException as e:
+            self.results.record(route, started, error=e)
+            return None
+        self.results.record(route, started, response=response)
+        return response
+
+    def login(self):
+        self.request('login', 'POST', '/login', data={'username': self.username, 'password': PASSWORD})
+
+    def dashboard(self):
+        response = self.request('dashboard', 'GET', '/dashboard')
+        if response is not None and response.status_code == 200:
+            self.item_ids = [int(item_id) for item_id in ITEM_LINK.findall(response.text)]
+
+    def view(self):
+        if self.item_ids:
+            self.request('view', 'GET', f'/data/{random.choice(self.item_ids)}')
+
+    def create(self):
+        self.request('create', 'POST', '/data/new', data={
+            'data_type': random.choice(['password', 'note', 'credit_card']),
+            'content': os.urandom(24).hex(),
+            'tags': random.choice(['work', 'home', 'work, email', ''])
+        })
+
+    def edit(self):
+        if self.item_ids:
+            self.request('edit', 'POST', f'/data/{random.choice(self.item_ids)}/edit', data={
+                'data_type': 'note',
+                'content': os.urandom(24).hex(),
+                'tags': 'edited'
+            })
+
+    def delete(self):
+        if self.item_ids:
+            item_id = self.item_ids.pop(random.randrange(len(self.item_ids)))
+            self.request('delete', 'POST', f'/data/{item_id}/delete')
+
+    def run(self, stop_event):
+        self.login()
+        self.dashboard()
+        actions = list(TRAFFIC_MIX)
+        weights = list(TRAFFIC_MIX.values())
+        while not stop_event.is_set():
+            getattr(self, random.choices(actions, weights)[0])()
+
+
+def seed_users(count):
+    """Create the load test users through create_initial_users.create_user"""
+    from create_initial_users import app, create_user
+    from extensions import db
+
+    usernames = [f'loadtest{i}' for i in range(count)]
+    with app.app_context():
+        db.create_all()
+        for username in usernames:
+            create_user(username, PASSWORD, f'{username}@loadtest.invalid')
+        db.session.commit()
+    return usernames
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, threads, env):
+    """Start waitress-serve app:app and wait until it accepts connections"""
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'waitress', f'--listen=127.0.0.1:{port}', f'--threads={threads}', 'app:app'],
+        cwd=BASE_DIR, env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic')
+    parser.add_argument('--threads', type=int, default=8, help='waitress worker threads')
+    parser.add_argument('--url', help='target an already running server instead')
+    args = parser.parse_args()
+
+    server = None
+    scratch_dir = None
+    if args.url is None:
+        # Point the seeding (in this process) and the server at a scratch database
+        scratch_dir = tempfile.TemporaryDirectory(prefix='loadtest-')
+        os.environ['FLASK_ENV'] = 'testing'
+        os.environ['TEST_DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch_dir.name, 'loadtest.db')
+        os.environ['LOAD_STATE_DIR'] = os.path.join(scratch_dir.name, 'load_state')
+        os.environ['JOURNAL_DIR'] = os.path.join(scratch_dir.name, 'journal')
+        os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+
+    usernames = seed_users(args.concurrency)
+
+    try:
+        if args.url is None:
+            port = free_port()
+            server = start_server(port, args.threads, os.environ.copy())
+            base_url = f'http://127.0.0.1:{port}'
+        else:
+            base_url = args.url.rstrip('/')
+
+        results = Results()
+        stop_event = threading.Event()
+        users = [VirtualUser(base_url, username, results) for username in usernames]
+        threads = [threading.Thread(target=user.run, args=(stop_event,)) for user in users]
+
+        print(f"Running {args.concurrency} virtual users against {base_url} for {args.duration:.0f}s")
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        results.report(time.perf_counter() - started)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if scratch_dir is not None:
+            scratch_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
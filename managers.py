@@ -0,0 +1,47 @@
+import threading
+from flask import current_app
+from db_routing import replica_url
+
+# Managers are created on first use and cached on the app
+_lock = threading.Lock()
+
+
+def get_sync_manager(app=None):
+    """Return the app's SyncManager, creating it on first use"""
+    app = app or current_app._get_current_object()
+    with _lock:
+        if 'sync_manager' not in app.extensions:
+            from sync_manager import SyncManager
+            app.extensions['sync_manager'] = SyncManager(
+                local_db_url=app.config['SQLALCHEMY_DATABASE_URI'],
+                cloud_db_url=app.config['CLOUD_DATABASE_URL'],
+                read_db_url=replica_url(app)
+            )
+        return app.extensions['sync_manager']
+
+
+def get_backup_manager(app=None):
+    """Return the app's BackupManager, creating it on first use"""
+    app = app or current_app._get_current_object()
+    with _lock:
+        if 'backup_manager' not in app.extensions:
+            from backup_manager import BackupManager
+            app.extensions['backup_manager'] = BackupManager(
+                db_url=app.config['SQLALCHEMY_DATABASE_URI'],
+                backup_dir=app.config['BACKUP_DIR'],
+                read_db_url=replica_url(app),
+                journal_dir=app.config['JOURNAL_DIR'] if app.config['JOURNAL_ENABLED'] else None,
+                verify_workers=app.config['BACKUP_VERIFY_WORKERS'],
+                verify_sample_size=app.config['BACKUP_VERIFY_SAMPLE']
+            )
+        return app.extensions['backup_manager']
+
+
+def get_database_manager(app=None):
+    """Return the app's DatabaseManager, creating it on first use"""
+    app = app or current_app._get_current_object()
+    with _lock:
+        if 'database_manager' not in app.extensions:
+            from db_manager import DatabaseManager
+            app.extensions['database_manager'] = DatabaseManager(app.config['SQLALCHEMY_DATABASE_URI'])
+        return app.extensions['database_manager']
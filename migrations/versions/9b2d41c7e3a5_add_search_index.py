@@ -0,0 +1,61 @@
+"""Add encrypted tags and blind search index
+
+Revision ID: 9b2d41c7e3a5
+Revises: 4f4cea74358f
+Create Date: 2026-10-19 09:12:04.318422
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d41c7e3a5'
+down_revision = '4f4cea74358f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('encrypted_data', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('encrypted_tags', sa.Text(), nullable=True))
+
+    op.create_table('search_index',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('data_id', sa.Integer(), nullable=False),
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.ForeignKeyConstraint(['data_id'], ['encrypted_data.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('search_index', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_search_index_data_id'), ['data_id'], unique=False)
+        batch_op.create_index('ix_search_index_user_token', ['user_id', 'token_hash'], unique=False)
+
+    # Existing items have no tags yet, index their data types
+    connection = op.get_bind()
+    items = connection.execute(sa.text(
+        "SELECT id, user_id, data_type FROM encrypted_data WHERE user_id IS NOT NULL")).all()
+    if items:
+        # The tokens are keyed HMACs, the key comes from the app's configuration
+        from search_index import TYPE_PREFIX, blind_index
+        search_index = sa.table('search_index',
+                                sa.column('user_id', sa.Integer),
+                                sa.column('data_id', sa.Integer),
+                                sa.column('token_hash', sa.String))
+        op.bulk_insert(search_index, [
+            {'user_id': user_id, 'data_id': data_id, 'token_hash': blind_index(TYPE_PREFIX, data_type)}
+            for data_id, user_id, data_type in items
+        ])
+
+
+def downgrade():
+    with op.batch_alter_table('search_index', schema=None) as batch_op:
+        batch_op.drop_index('ix_search_index_user_token')
+        batch_op.drop_index(batch_op.f('ix_search_index_data_id'))
+
+    op.drop_table('search_index')
+
+    with op.batch_alter_table('encrypted_data', schema=None) as batch_op:
+        batch_op.drop_column('encrypted_tags')
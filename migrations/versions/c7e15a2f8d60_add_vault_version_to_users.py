@@ -0,0 +1,28 @@
+"""Add vault version to users
+
+Revision ID: c7e15a2f8d60
+Revises: 9b2d41c7e3a5
+Create Date: 2026-10-19 11:40:27.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e15a2f8d60'
+down_revision = '9b2d41c7e3a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('vault_version', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('vault_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('vault_updated_at')
+        batch_op.drop_column('vault_version')
@@ -0,0 +1,40 @@
+"""Add vault transfers
+
+Revision ID: e4a9c3d1b702
+Revises: c7e15a2f8d60
+Create Date: 2026-10-19 14:05:12.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c3d1b702'
+down_revision = 'c7e15a2f8d60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('vault_transfers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('source', sa.String(length=255), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('rows_done', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('vault_transfers', schema=None) as batch_op:
+        batch_op.create_index('ix_vault_transfers_user_fingerprint', ['user_id', 'fingerprint'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('vault_transfers', schema=None) as batch_op:
+        batch_op.drop_index('ix_vault_transfers_user_fingerprint')
+
+    op.drop_table('vault_transfers')
@@ -0,0 +1,45 @@
+"""Add vault stats and sync state
+
+Revision ID: f1b8d6a4c253
+Revises: e4a9c3d1b702
+Create Date: 2026-10-19 16:42:37.504129
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b8d6a4c253'
+down_revision = 'e4a9c3d1b702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('vault_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('data_type', sa.String(length=50), nullable=False),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.Column('content_bytes', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'data_type')
+    )
+    op.create_table('sync_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('last_synced_at', sa.DateTime(), nullable=True),
+    sa.Column('items_changed', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Roll up the existing items, later writes keep the rows current
+    op.execute(
+        "INSERT INTO vault_stats (user_id, data_type, item_count, content_bytes) "
+        "SELECT user_id, data_type, COUNT(*), "
+        "COALESCE(SUM(LENGTH(encrypted_content) + COALESCE(LENGTH(encrypted_tags), 0)), 0) "
+        "FROM encrypted_data WHERE user_id IS NOT NULL GROUP BY user_id, data_type"
+    )
+
+
+def downgrade():
+    op.drop_table('sync_state')
+    op.drop_table('vault_stats')
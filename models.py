@@ -1,18 +1,48 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from cryptography.fernet import Fernet
 import os
+import threading
 from dotenv import load_dotenv
 from extensions import db  # Import db from extensions
+from profiling import span
 
 # Load environment variables
 load_dotenv()
 
-# Get encryption key from environment or generate new one
-ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', Fernet.generate_key().decode())
-cipher_suite = Fernet(ENCRYPTION_KEY.encode())
+# The encryption suite is created on first use, so importing the models
+# does not pay for loading the cryptography package
+_encryption_key = None
+_cipher_suite = None
+_cipher_lock = threading.Lock()
+
+def get_cipher_suite():
+    """Return the Fernet suite, created on first use"""
+    global _encryption_key, _cipher_suite
+    if _cipher_suite is None:
+        with _cipher_lock:
+            if _cipher_suite is None:
+                from cryptography.fernet import Fernet
+                # Get encryption key from environment or generate new one
+                _encryption_key = os.getenv('ENCRYPTION_KEY') or Fernet.generate_key().decode()
+                _cipher_suite = Fernet(_encryption_key.encode())
+    return _cipher_suite
+
+def get_encryption_key():
+    """Return the encryption key in use"""
+    get_cipher_suite()
+    return _encryption_key
+
+def encrypt_value(value):
+    """Encrypt a plaintext string"""
+    with span('encrypt'):
+        return get_cipher_suite().encrypt(value.encode()).decode()
+
+def decrypt_value(value):
+    """Decrypt a ciphertext string"""
+    with span('decrypt'):
+        return get_cipher_suite().decrypt(value.encode()).decode()
 
 Base = declarative_base()
 
@@ -25,6 +55,8 @@ class User(db.Model):
     email = Column(String(120), unique=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_admin = Column(Boolean, default=False)
+    vault_version = Column(Integer, nullable=False, default=0, server_default='0')  # Bumped on every vault change
+    vault_updated_at = Column(DateTime)
     
     # Relationships
     encrypted_data = relationship("EncryptedData", back_populates="user")
@@ -56,6 +88,7 @@ class EncryptedData(db.Model):
     user_id = Column(Integer, ForeignKey('users.id'))
     data_type = Column(String(50), nullable=False)  # e.g., 'credit_card', 'password', 'note'
     encrypted_content = Column(Text, nullable=False)
+    encrypted_tags = Column(Text)  # Comma separated search tags, encrypted like the content
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -64,20 +97,84 @@ class EncryptedData(db.Model):
     
     def encrypt_content(self, content):
         """Encrypt the content before storing"""
-        return cipher_suite.encrypt(content.encode()).decode()
+        return encrypt_value(content)
     
     def decrypt_content(self):
         """Decrypt the stored content"""
-        return cipher_suite.decrypt(self.encrypted_content.encode()).decode()
+        return decrypt_value(self.encrypted_content)
     
     @property
     def decrypted_content(self):
         """Property to access decrypted content"""
         return self.decrypt_content()
     
+    @property
+    def decrypted_tags(self):
+        """Property to access the decrypted search tags as a list"""
+        if not self.encrypted_tags:
+            return []
+        return [tag for tag in decrypt_value(self.encrypted_tags).split(',') if tag]
+    
     def __repr__(self):
         return f"<EncryptedData {self.data_type}>"
 
+class SearchIndex(db.Model):
+    __tablename__ = 'search_index'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    data_id = Column(Integer, ForeignKey('encrypted_data.id'), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False)  # Keyed HMAC of a type or tag token
+    
+    __table_args__ = (
+        Index('ix_search_index_user_token', 'user_id', 'token_hash'),
+    )
+    
+    def __repr__(self):
+        return f"<SearchIndex {self.data_id}>"
+
+class VaultTransfer(db.Model):
+    __tablename__ = 'vault_transfers'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    source = Column(String(255), nullable=False)  # File name, for reference only
+    fingerprint = Column(String(64), nullable=False)  # Identifies the file across runs
+    rows_done = Column(Integer, nullable=False, default=0)  # Input rows consumed, committed with the items
+    status = Column(String(20), nullable=False, default='running')  # 'running' or 'done'
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_vault_transfers_user_fingerprint', 'user_id', 'fingerprint'),
+    )
+    
+    def __repr__(self):
+        return f"<VaultTransfer {self.source} {self.status}>"
+
+class VaultStats(db.Model):
+    __tablename__ = 'vault_stats'
+    
+    # Rollup of a user's items of one type, maintained by vault_stats
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    data_type = Column(String(50), primary_key=True)
+    item_count = Column(Integer, nullable=False, default=0)
+    content_bytes = Column(Integer, nullable=False, default=0)  # Size of the ciphertext of content and tags
+    
+    def __repr__(self):
+        return f"<VaultStats {self.user_id} {self.data_type}>"
+
+class SyncState(db.Model):
+    __tablename__ = 'sync_state'
+    
+    # A single row, written by every completed sync
+    id = Column(Integer, primary_key=True)
+    last_synced_at = Column(DateTime)
+    items_changed = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<SyncState {self.last_synced_at}>"
+
 # Create database engine
 # def init_db(): # This function is no longer needed
 #     """Initialize the database"""
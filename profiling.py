@@ -0,0 +1,216 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Set by Profiler.init_app, spans cost nothing while profiling is disabled
+enabled = False
+_listening = False
+
+_LITERALS = re.compile(r"\b\d+\b|'[^']*'")
+
+
+class RequestProfile:
+    """Timings collected while handling one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.statements = Counter()
+        self.spans = defaultdict(float)
+        self.span_counts = Counter()
+        self.profiler = None
+
+
+def _current_profile():
+    if has_request_context():
+        return g.get('request_profile')
+    return None
+
+
+@contextmanager
+def _timed_span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = _current_profile()
+        if profile is not None:
+            profile.spans[name] += time.perf_counter() - started
+            profile.span_counts[name] += 1
+
+
+def span(name):
+    """Time a block of code as part of the current request's profile"""
+    if not enabled:
+        return nullcontext()
+    return _timed_span(name)
+
+
+class Profiler:
+    """Opt-in request instrumentation, enabled with PROFILING_ENABLED
+
+    - times every SQL statement, logs slow ones and counts them per request
+    - flags statements repeated within a request, the signature of N+1
+      lazy loads such as User.encrypted_data
+    - records spans for encryption and template rendering
+    - runs cProfile (or pyinstrument) on a sample of requests and writes the
+      results to a directory keeping the newest PROFILE_KEEP files
+    - reports the totals in a Server-Timing response header
+    """
+
+    def init_app(self, app):
+        global enabled, _listening
+        if not app.config['PROFILING_ENABLED']:
+            return
+        enabled = True
+
+        self.slow_query_ms = app.config['SLOW_QUERY_MS']
+        self.n_plus_one_threshold = app.config['N_PLUS_ONE_THRESHOLD']
+        self.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self.profile_dir = app.config['PROFILE_DIR']
+        self.profile_keep = app.config['PROFILE_KEEP']
+        self.use_pyinstrument = app.config['PROFILER'] == 'pyinstrument'
+
+        # Listen on every engine, including the ones of the managers
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            _listening = True
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        # Also runs for requests that raised, which skip after_request
+        app.teardown_request(self._teardown_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start_time'].pop()
+        if duration * 1000 >= self.slow_query_ms:
+            # Never the parameters, they hold password hashes, ciphertext and blind indexes
+            logger.warning("Slow query (%.1f ms): %s%s", duration * 1000, statement,
+                           f" ({len(parameters)} parameter sets)" if executemany else "")
+
+        profile = _current_profile()
+        if profile is not None:
+            profile.query_count += 1
+            profile.query_time += duration
+            profile.statements[_LITERALS.sub('?', statement)] += 1
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.cursor is not None:
+            starts = context.connection.info.get('query_start_time')
+            if starts:
+                starts.pop()
+
+    def _before_render(self, sender, template, context, **extra):
+        profile = _current_profile()
+        if profile is not None:
+            g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        profile = _current_profile()
+        starts = g.get('template_starts')
+        if profile is not None and starts:
+            profile.spans['template'] += time.perf_counter() - starts.pop()
+            profile.span_counts['template'] += 1
+
+    def _before_request(self):
+        g.request_profile = profile = RequestProfile()
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile.profiler = self._start_profiler()
+
+    def _after_request(self, response):
+        profile = g.get('request_profile')
+        if profile is None:
+            return response
+        duration = time.perf_counter() - profile.started
+
+        for statement, count in profile.statements.items():
+            if count >= self.n_plus_one_threshold:
+                logger.warning("Possible N+1 in %s: %d executions of %s", request.endpoint, count, statement)
+
+        timings = [f'db;dur={profile.query_time * 1000:.1f};desc="{profile.query_count} queries"']
+        for name, total in profile.spans.items():
+            timings.append(f'{name};dur={total * 1000:.1f};desc="{profile.span_counts[name]} calls"')
+        timings.append(f'total;dur={duration * 1000:.1f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+
+        logger.debug("%s %s: %.1f ms, %d queries (%.1f ms), %s", request.method, request.path,
+                     duration * 1000, profile.query_count, profile.query_time * 1000,
+                     {name: round(total * 1000, 1) for name, total in profile.spans.items()})
+        return response
+
+    def _teardown_request(self, exc):
+        profile = g.pop('request_profile', None)
+        if profile is not None and profile.profiler is not None:
+            self._save_profile(profile.profiler, time.perf_counter() - profile.started)
+
+    def _start_profiler(self):
+        if self.use_pyinstrument:
+            try:
+                from pyinstrument import Profiler as PyinstrumentProfiler
+            except ImportError:
+                logger.warning("pyinstrument is not installed, falling back to cProfile")
+                self.use_pyinstrument = False
+            else:
+                profiler = PyinstrumentProfiler()
+                profiler.start()
+                return profiler
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request is being profiled already
+            return None
+        return profiler
+
+    def _save_profile(self, profiler, duration):
+        # Stopped first, a profiler left running would slow down every later request of the thread
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+        if self.profile_keep <= 0:
+            self._rotate()
+            return
+
+        endpoint = (request.endpoint or 'unknown').replace('.', '_')
+        name = f"{time.strftime('%Y%m%d_%H%M%S')}_{int(time.time() * 1000) % 1000:03d}_{endpoint}_{duration * 1000:.0f}ms"
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            if isinstance(profiler, cProfile.Profile):
+                profiler.dump_stats(os.path.join(self.profile_dir, name + '.prof'))
+            else:
+                with open(os.path.join(self.profile_dir, name + '.html'), 'w') as f:
+                    f.write(profiler.output_html())
+        except OSError as e:
+            logger.warning("Could not save profile %s: %s", name, e)
+            return
+        self._rotate()
+
+    def _rotate(self):
+        """Keep only the newest profile_keep profiles"""
+        if not os.path.isdir(self.profile_dir):
+            return
+        files = sorted(os.listdir(self.profile_dir))
+        for name in files[:max(len(files) - self.profile_keep, 0)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except OSError:
+                pass
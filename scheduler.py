@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+
+
+class Job:
+    """A periodic background job and its scheduling state"""
+
+    def __init__(self, name, func, interval, group=None, heavy=False, jitter=0.1,
+                 retry_delay=60, max_backoff=3600, initial_delay=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.group = group
+        self.heavy = heavy
+        self.jitter = jitter
+        self.retry_delay = retry_delay
+        self.max_backoff = max_backoff
+
+        self.next_run = time.monotonic() + initial_delay
+        self.failures = 0
+        self.deferred_since = None
+        self.is_running = False
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+
+    def _jittered(self, delay):
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def schedule_success(self, now):
+        self.failures = 0
+        self.next_run = now + self._jittered(self.interval)
+
+    def schedule_failure(self, now):
+        """Retry with exponential backoff, capped by max_backoff"""
+        self.failures += 1
+        delay = min(self.retry_delay * 2 ** (self.failures - 1), self.max_backoff)
+        self.next_run = now + self._jittered(delay)
+
+    def __repr__(self):
+        return f"<Job {self.name}>"
+
+
+class Scheduler:
+    """Single scheduler for the worker's periodic jobs
+
+    Jobs sharing a group never run at the same time, so a backup and a sync
+    cannot collide on the same database. Heavy jobs are deferred while the
+    web processes report high load, up to max_defer seconds. All waits are
+    on one event, so stop() takes effect immediately. Running jobs are
+    signalled through the stopping event, which long jobs may poll, and
+    waited for at most stop_timeout seconds.
+    """
+
+    def __init__(self, load_source=None, max_latency_ms=500, max_in_flight=8,
+                 defer_interval=30, max_defer=1800, stop_timeout=10):
+        self.load_source = load_source
+        self.max_latency_ms = max_latency_ms
+        self.max_in_flight = max_in_flight
+        self.defer_interval = defer_interval
+        self.max_defer = max_defer
+        self.stop_timeout = stop_timeout
+
+        self.jobs = []
+        self.running_groups = set()
+        self.job_threads = []
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.is_running = False
+        self.thread = None
+
+    def add_job(self, name, func, interval, **options):
+        """Register a job, see Job for the available options"""
+        job = Job(name, func, interval, **options)
+        with self.lock:
+            self.jobs.append(job)
+        self.wakeup.set()
+        return job
+
+    def start(self):
+        """Start the scheduler in a background thread"""
+        if not self.is_running:
+            self.is_running = True
+            self.wakeup.clear()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run_loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self, wait=True):
+        """Stop scheduling jobs, optionally waiting a while for running jobs to finish"""
+        self.is_running = False
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            job_threads = self.job_threads
+            self.job_threads = []
+        if wait:
+            deadline = time.monotonic() + self.stop_timeout
+            for thread in job_threads:
+                thread.join(max(deadline - time.monotonic(), 0))
+            still_running = [thread.name for thread in job_threads if thread.is_alive()]
+            if still_running:
+                # Daemon threads, they do not keep the process alive
+                print(f"Scheduler stopped with jobs still running: {', '.join(still_running)}")
+
+    def is_overloaded(self):
+        """Return True when the web processes report high load"""
+        if self.load_source is None:
+            return False
+        try:
+            in_flight, latency_ms = self.load_source()
+        except Exception as e:
+            print(f"Scheduler load check error: {e}")
+            return False
+        return in_flight > self.max_in_flight or latency_ms > self.max_latency_ms
+
+    def _run_loop(self):
+        while self.is_running:
+            self.wakeup.clear()
+            now = time.monotonic()
+            with self.lock:
+                due = [job for job in self.jobs if job.next_run <= now and not job.is_running]
+            for job in sorted(due, key=lambda job: job.next_run):
+                self._dispatch(job, now)
+
+            # Jobs waiting for their group are woken up when it is released
+            with self.lock:
+                pending = [
+                    job.next_run for job in self.jobs
+                    if not job.is_running and job.group not in self.running_groups
+                ]
+            timeout = max(min(pending) - time.monotonic(), 0) if pending else None
+            self.wakeup.wait(timeout)
+
+    def _dispatch(self, job, now):
+        if job.heavy and self.is_overloaded():
+            if job.deferred_since is None:
+                job.deferred_since = now
+            if now - job.deferred_since < self.max_defer:
+                job.next_run = now + self.defer_interval
+                return
+
+        with self.lock:
+            if job.group is not None and job.group in self.running_groups:
+                # Retried as soon as the group is released
+                return
+            if job.group is not None:
+                self.running_groups.add(job.group)
+            job.is_running = True
+            job.deferred_since = None
+
+            thread = threading.Thread(target=self._run_job, args=(job,), name=job.name)
+            thread.daemon = True
+            self.job_threads = [t for t in self.job_threads if t.is_alive()]
+            self.job_threads.append(thread)
+        thread.start()
+
+    def _run_job(self, job):
+        started = time.monotonic()
+        error = None
+        try:
+            job.func()
+        except Exception as e:
+            print(f"{job.name} error: {e}")
+            error = e
+        finally:
+            finished = time.monotonic()
+            with self.lock:
+                if error is None:
+                    job.schedule_success(finished)
+                else:
+                    job.schedule_failure(finished)
+                job.last_error = str(error) if error is not None else None
+                job.last_run = time.time()
+                job.last_duration = finished - started
+                job.is_running = False
+                if job.group is not None:
+                    self.running_groups.discard(job.group)
+            self.wakeup.set()
@@ -0,0 +1,169 @@
+import hashlib
+import hmac
+import os
+import re
+from dotenv import load_dotenv
+from models import EncryptedData, SearchIndex, get_encryption_key, decrypt_value
+
+# Load environment variables
+load_dotenv()
+
+_index_key = None
+
+TYPE_PREFIX = 'type:'
+TAG_PREFIX = 'tag:'
+
+# A quoted phrase, optionally prefixed (type:"credit card"), or a single word
+_TERM_PATTERN = re.compile(r'(\S*?)"([^"]*)"?|(\S+)')
+
+
+def normalize_token(value):
+    """Normalize a token so lookups are case and whitespace insensitive"""
+    return ' '.join(value.split()).casefold()
+
+
+def parse_tags(raw_tags):
+    """Split a comma separated tag string into unique, normalized tags"""
+    tags = []
+    for tag in (raw_tags or '').split(','):
+        tag = normalize_token(tag)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def get_index_key():
+    """Return the HMAC key of the blind indexes
+
+    Blind indexes are keyed HMACs, so the server can match exact tokens
+    without ever storing (or decrypting) the plaintext they were derived from.
+    A dedicated key is preferred; otherwise one is derived from the encryption key.
+    """
+    global _index_key
+    if _index_key is None:
+        env_key = os.getenv('SEARCH_INDEX_KEY')
+        if env_key:
+            _index_key = env_key.encode()
+        else:
+            _index_key = hmac.new(get_encryption_key().encode(), b'search-index', hashlib.sha256).digest()
+    return _index_key
+
+
+def blind_index(kind, value):
+    """Compute the keyed HMAC blind index for a token"""
+    message = f"{kind}{normalize_token(value)}".encode()
+    return hmac.new(get_index_key(), message, hashlib.sha256).hexdigest()
+
+
+def item_tokens(data_type, tags):
+    """Return the set of blind index hashes for an item"""
+    tokens = {blind_index(TYPE_PREFIX, data_type)}
+    tokens.update(blind_index(TAG_PREFIX, tag) for tag in tags)
+    return tokens
+
+
+def index_item(session, item, tags):
+    """(Re)build the index entries of a single item
+
+    The item must have been flushed so that it has an id.
+    """
+    remove_item(session, item.id)
+    session.add_all([
+        SearchIndex(user_id=item.user_id, data_id=item.id, token_hash=token)
+        for token in item_tokens(item.data_type, tags)
+    ])
+
+
+def remove_item(session, data_id):
+    """Remove all index entries of an item"""
+    session.query(SearchIndex).filter_by(data_id=data_id).delete(synchronize_session=False)
+
+
+def rebuild_index(session, user_id=None, data_ids=None, batch_size=500):
+    """Rebuild index entries in bulk from the stored items
+
+    Only the (small) encrypted tag list of each item is decrypted, never its
+    content. Restrict the rebuild with ``user_id`` or ``data_ids``.
+    """
+    delete_query = session.query(SearchIndex)
+    item_query = session.query(
+        EncryptedData.id, EncryptedData.user_id,
+        EncryptedData.data_type, EncryptedData.encrypted_tags
+    )
+    if user_id is not None:
+        delete_query = delete_query.filter_by(user_id=user_id)
+        item_query = item_query.filter(EncryptedData.user_id == user_id)
+    if data_ids is not None:
+        data_ids = list(data_ids)
+        if not data_ids:
+            return 0
+        delete_query = delete_query.filter(SearchIndex.data_id.in_(data_ids))
+        item_query = item_query.filter(EncryptedData.id.in_(data_ids))
+    delete_query.delete(synchronize_session=False)
+
+    # Walk the items in id order, one batch at a time
+    count = 0
+    last_id = 0
+    while True:
+        batch = item_query.filter(EncryptedData.id > last_id).order_by(EncryptedData.id).limit(batch_size).all()
+        if not batch:
+            break
+        entries = []
+        for row in batch:
+            tags = parse_tags(decrypt_value(row.encrypted_tags)) if row.encrypted_tags else []
+            entries.extend(
+                {'user_id': row.user_id, 'data_id': row.id, 'token_hash': token}
+                for token in item_tokens(row.data_type, tags)
+            )
+        session.bulk_insert_mappings(SearchIndex, entries)
+        count += len(batch)
+        last_id = batch[-1].id
+    return count
+
+
+def parse_query(query):
+    """Turn a search string into a list of alternative token hashes per term
+
+    ``type:<data type>`` matches the data type exactly, any other term matches
+    either a tag or the data type. Quoted phrases ("bank account") are one
+    term, so tags and types of several words can be matched.
+    """
+    terms = []
+    for prefix, phrase, word in _TERM_PATTERN.findall(query or ''):
+        term = word or prefix + phrase
+        if not normalize_token(term):
+            continue
+        if term.casefold().startswith(TYPE_PREFIX):
+            value = term[len(TYPE_PREFIX):]
+            if normalize_token(value):
+                terms.append([blind_index(TYPE_PREFIX, value)])
+        else:
+            terms.append([blind_index(TAG_PREFIX, term), blind_index(TYPE_PREFIX, term)])
+    return terms
+
+
+def search(session, user_id, query):
+    """Return the user's items that match every term of the query
+
+    Each term is resolved with an index scan on (user_id, token_hash), so
+    only matching items are loaded.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return []
+
+    matching_ids = None
+    for hashes in terms:
+        rows = session.query(SearchIndex.data_id).filter(
+            SearchIndex.user_id == user_id,
+            SearchIndex.token_hash.in_(hashes)
+        ).distinct()
+        ids = {row.data_id for row in rows}
+        matching_ids = ids if matching_ids is None else matching_ids & ids
+        if not matching_ids:
+            return []
+
+    return session.query(EncryptedData).filter(
+        EncryptedData.user_id == user_id,
+        EncryptedData.id.in_(matching_ids)
+    ).order_by(EncryptedData.updated_at.desc()).all()
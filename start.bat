@@ -1 +1,3 @@
+python build_assets.py
+start "secure-db-worker" python worker.py
  C:\Users\leosknark\AppData\Roaming\Python\Python313\Scripts\waitress-serve --listen=0.0.0.0:5000 app:app
\ No newline at end of file
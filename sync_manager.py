@@ -1,66 +1,61 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-import threading
-import time
 from datetime import datetime
 import json
 import os
-from models import Base, User, EncryptedData
-from config import Config
+from extensions import db, LOCAL_SESSION_INFO
+from models import User, EncryptedData
+import search_index
+import vault_cache
+import vault_stats
+
+# Ids per primary lookup, below SQLite's bound parameter limit
+LOOKUP_BATCH_SIZE = 500
 
 class SyncManager:
-    def __init__(self, local_db_url, cloud_db_url=None):
+    def __init__(self, local_db_url, cloud_db_url=None, read_db_url=None):
         self.local_engine = create_engine(local_db_url)
         self.cloud_engine = create_engine(cloud_db_url) if cloud_db_url else None
         
-        self.local_Session = sessionmaker(bind=self.local_engine)
+        # Local changes made by the sync are journaled and counted in the statistics
+        self.local_Session = sessionmaker(bind=self.local_engine, info=dict(LOCAL_SESSION_INFO))
         self.cloud_Session = sessionmaker(bind=self.cloud_engine) if cloud_db_url else None
         
-        self.sync_thread = None
-        self.is_running = False
-        
-        # Initialize cloud database if available
-        if self.cloud_engine:
-            Base.metadata.create_all(self.cloud_engine)
+        # The full scan of the local items reads from a replica when one is configured
+        self.read_engine = create_engine(read_db_url) if read_db_url else None
+        self.read_Session = sessionmaker(bind=self.read_engine) if read_db_url else None
+        self.cloud_initialized = False
     
-    def start_sync(self):
-        """Start the sync process in a background thread"""
-        if not self.is_running:
-            self.is_running = True
-            self.sync_thread = threading.Thread(target=self._sync_loop)
-            self.sync_thread.daemon = True
-            self.sync_thread.start()
-    
-    def stop_sync(self):
-        """Stop the sync process"""
-        self.is_running = False
-        if self.sync_thread:
-            self.sync_thread.join()
-    
-    def _sync_loop(self):
-        """Main sync loop"""
-        while self.is_running:
-            try:
-                self.sync_data()
-                time.sleep(Config.SYNC_INTERVAL)
-            except Exception as e:
-                print(f"Sync error: {e}")
-                time.sleep(60)  # Wait a minute before retrying
+    def _init_cloud_database(self):
+        """Create the cloud tables on first sync rather than at startup"""
+        if not self.cloud_initialized:
+            db.metadata.create_all(self.cloud_engine)
+            self.cloud_initialized = True
     
     def sync_data(self):
         """Sync data between local and cloud databases"""
         if not self.cloud_engine:
             return
         
+        # Initialize cloud database if available
+        self._init_cloud_database()
+        
         local_session = self.local_Session()
         cloud_session = self.cloud_Session()
+        read_session = self.read_Session() if self.read_Session else local_session
         
         try:
             # Sync users
             self._sync_users(local_session, cloud_session)
             
             # Sync encrypted data
-            self._sync_encrypted_data(local_session, cloud_session)
+            changed_items = self._sync_encrypted_data(local_session, cloud_session, read_session)
+            
+            # Keep the local search index consistent with the synced items
+            local_session.flush()
+            search_index.rebuild_index(local_session, data_ids=[item.id for item in changed_items])
+            vault_cache.bump_vault_version(local_session, {item.user_id for item in changed_items})
+            vault_stats.record_sync(local_session, datetime.utcnow(), len(changed_items))
             
             # Commit changes
             local_session.commit()
@@ -71,6 +66,7 @@ class SyncManager:
             cloud_session.rollback()
             raise e
         finally:
+            read_session.close()
             local_session.close()
             cloud_session.close()
     
@@ -116,11 +112,42 @@ class SyncManager:
                 local_user.password_hash = cloud_user.password_hash
                 local_user.email = cloud_user.email
     
-    def _sync_encrypted_data(self, local_session, cloud_session):
-        """Sync encrypted data between databases"""
-        # Get all encrypted data from both databases
-        local_data = {(d.id, d.user_id): d for d in local_session.query(EncryptedData).all()}
+    def _sync_encrypted_data(self, local_session, cloud_session, read_session):
+        """Sync encrypted data between databases
+        
+        The local items are scanned on read_session, which may be a lagging
+        replica. Only the items whose scanned values differ from the cloud are
+        loaded from the primary and synced, so stale replica rows are never
+        written anywhere; changes the replica has not seen yet are picked up by
+        a later sync.
+        
+        Returns the local items that were created or changed by the sync.
+        """
+        # Scan both databases and find the items that differ
+        scanned = {
+            (row.id, row.user_id): (row.data_type, row.encrypted_content, row.encrypted_tags, row.updated_at)
+            for row in read_session.query(EncryptedData.id, EncryptedData.user_id, EncryptedData.data_type,
+                                          EncryptedData.encrypted_content, EncryptedData.encrypted_tags,
+                                          EncryptedData.updated_at)
+        }
         cloud_data = {(d.id, d.user_id): d for d in cloud_session.query(EncryptedData).all()}
+        candidates = {
+            key for key in scanned.keys() | cloud_data.keys()
+            if key not in cloud_data or scanned.get(key) != (
+                cloud_data[key].data_type, cloud_data[key].encrypted_content,
+                cloud_data[key].encrypted_tags, cloud_data[key].updated_at)
+        }
+        cloud_data = {key: item for key, item in cloud_data.items() if key in candidates}
+        
+        # Load the current version of the differing items from the primary
+        candidate_ids = sorted({data_id for data_id, user_id in candidates})
+        local_data = {}
+        for start in range(0, len(candidate_ids), LOOKUP_BATCH_SIZE):
+            batch = candidate_ids[start:start + LOOKUP_BATCH_SIZE]
+            for d in local_session.query(EncryptedData).filter(EncryptedData.id.in_(batch)):
+                if (d.id, d.user_id) in candidates:
+                    local_data[(d.id, d.user_id)] = d
+        changed_items = []
         
         # Sync from local to cloud
         for (data_id, user_id), local_item in local_data.items():
@@ -130,6 +157,7 @@ class SyncManager:
                     user_id=user_id,
                     data_type=local_item.data_type,
                     encrypted_content=local_item.encrypted_content,
+                    encrypted_tags=local_item.encrypted_tags,
                     created_at=local_item.created_at,
                     updated_at=local_item.updated_at
                 )
@@ -139,6 +167,7 @@ class SyncManager:
                 cloud_item = cloud_data[(data_id, user_id)]
                 cloud_item.data_type = local_item.data_type
                 cloud_item.encrypted_content = local_item.encrypted_content
+                cloud_item.encrypted_tags = local_item.encrypted_tags
                 cloud_item.updated_at = local_item.updated_at
         
         # Sync from cloud to local
@@ -149,13 +178,22 @@ class SyncManager:
                     user_id=user_id,
                     data_type=cloud_item.data_type,
                     encrypted_content=cloud_item.encrypted_content,
+                    encrypted_tags=cloud_item.encrypted_tags,
                     created_at=cloud_item.created_at,
                     updated_at=cloud_item.updated_at
                 )
                 local_session.add(local_item)
+                changed_items.append(local_item)
             else:
                 # Update existing data locally
                 local_item = local_data[(data_id, user_id)]
+                local_values = (local_item.data_type, local_item.encrypted_content, local_item.encrypted_tags)
+                cloud_values = (cloud_item.data_type, cloud_item.encrypted_content, cloud_item.encrypted_tags)
+                if local_values != cloud_values:
+                    changed_items.append(local_item)
                 local_item.data_type = cloud_item.data_type
                 local_item.encrypted_content = cloud_item.encrypted_content
-                local_item.updated_at = cloud_item.updated_at 
\ No newline at end of file
+                local_item.encrypted_tags = cloud_item.encrypted_tags
+                local_item.updated_at = cloud_item.updated_at
+        
+        return changed_items 
\ No newline at end of file
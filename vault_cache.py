@@ -0,0 +1,49 @@
+from datetime import datetime
+from flask import current_app, request, session
+from werkzeug.http import is_resource_modified
+from extensions import assets
+from models import User
+
+
+def bump_vault_version(db_session, user_ids=None):
+    """Mark users' vaults as changed, or every vault when user_ids is None
+
+    The version is part of the ETag of the vault pages and of the fragment
+    cache keys, so bumping it invalidates both.
+    """
+    query = db_session.query(User)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        query = query.filter(User.id.in_(user_ids))
+    query.update({
+        User.vault_version: User.vault_version + 1,
+        User.vault_updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+
+
+def vault_etag(user):
+    # Pages embed fingerprinted asset URLs, so a new asset build changes them too
+    return f"vault-{user.id}-{user.vault_version}-{assets.version}"
+
+
+def not_modified(user):
+    """Return a 304 response if the client's copy of the user's vault is current"""
+    # Pending flash messages are rendered into the page, so it must be sent
+    if '_flashes' in session:
+        return None
+    if is_resource_modified(request.environ, etag=vault_etag(user), last_modified=user.vault_updated_at):
+        return None
+    return set_validators(current_app.response_class(status=304), user)
+
+
+def set_validators(response, user):
+    """Add the vault's ETag and Last-Modified to a response"""
+    response.set_etag(vault_etag(user))
+    if user.vault_updated_at is not None:
+        response.last_modified = user.vault_updated_at
+    # Browsers keep the page but revalidate it on every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
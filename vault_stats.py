@@ -0,0 +1,189 @@
+"""Vault statistics for the admins, read from incrementally maintained rollups
+
+VaultStats holds one row per user and data type with the number of items
+and the size of their ciphertext. Every ORM flush of EncryptedData on a
+session with STATS_INFO_KEY in its info (all sessions of the local
+database, see extensions.LOCAL_SESSION_INFO) adjusts those rows in the
+same transaction, so the statistics cost the same to read however large
+the vaults grow.
+Writes that bypass the ORM (restores, recovery) call rebuild_stats for the
+users they touched, and `flask rebuild-vault-stats` recomputes everything.
+"""
+from collections import defaultdict
+from sqlalchemy import event, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+from extensions import STATS_INFO_KEY
+from models import User, EncryptedData, VaultStats, SyncState
+
+TRACKED_ATTRIBUTES = ('user_id', 'data_type', 'encrypted_content', 'encrypted_tags')
+
+_listening = False
+
+
+def track_vault_stats():
+    """Keep the rollups current on every ORM write of the local database"""
+    global _listening
+    if not _listening:
+        event.listen(Session, 'after_flush', _after_flush)
+        _listening = True
+
+
+def item_size(encrypted_content, encrypted_tags):
+    # Fernet tokens are ASCII, characters are bytes
+    return len(encrypted_content or '') + len(encrypted_tags or '')
+
+
+def _values(state, before):
+    """Return an item's (user id, data type, size) before or after the flush
+
+    Returns None if a value needed was not loaded, it cannot be known
+    without a query.
+    """
+    values = []
+    for key in TRACKED_ATTRIBUTES:
+        history = state.attrs[key].history
+        current = (history.deleted or history.unchanged) if before else (history.added or history.unchanged)
+        if not current:
+            return None
+        values.append(current[0])
+    user_id, data_type, encrypted_content, encrypted_tags = values
+    return user_id, data_type, item_size(encrypted_content, encrypted_tags)
+
+
+def _after_flush(session, flush_context):
+    if not session.info.get(STATS_INFO_KEY):
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    recount = set()
+
+    def add(values, sign):
+        user_id, data_type, size = values
+        if user_id is not None:
+            deltas[(user_id, data_type)][0] += sign
+            deltas[(user_id, data_type)][1] += sign * size
+
+    for obj in session.new:
+        if isinstance(obj, EncryptedData):
+            add((obj.user_id, obj.data_type, item_size(obj.encrypted_content, obj.encrypted_tags)), 1)
+    for obj in session.dirty | session.deleted:
+        if not isinstance(obj, EncryptedData):
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(state.attrs[key].history.has_changes() for key in TRACKED_ATTRIBUTES):
+            continue
+        before = _values(state, True)
+        after = _values(state, False) if obj in session.dirty else None
+        if before is None or (after is None and obj in session.dirty):
+            # Written without the previous values loaded, count the users again
+            recount.update(state.attrs['user_id'].history.sum())
+            continue
+        add(before, -1)
+        if after is not None:
+            add(after, 1)
+
+    connection = session.connection()
+    recount.discard(None)
+    apply_deltas(connection, {key: delta for key, delta in deltas.items() if key[0] not in recount})
+    if recount:
+        rebuild_stats(connection, recount)
+
+
+def apply_deltas(connection, deltas):
+    """Add {(user id, data type): [items, bytes]} to the rollups"""
+    table = VaultStats.__table__
+    removed = False
+    for (user_id, data_type), (count, size) in deltas.items():
+        if not count and not size:
+            continue
+        _upsert(connection, table, user_id, data_type, count, size)
+        removed = removed or count < 0
+    if removed:
+        # Types a user no longer has items of
+        connection.execute(table.delete().where(
+            table.c.user_id.in_({user_id for user_id, data_type in deltas}), table.c.item_count <= 0))
+
+
+def _upsert(connection, table, user_id, data_type, count, size):
+    increments = {
+        'item_count': table.c.item_count + count,
+        'content_bytes': table.c.content_bytes + size
+    }
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(table).values(
+            user_id=user_id, data_type=data_type, item_count=count, content_bytes=size)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.data_type], set_=increments))
+        return
+    result = connection.execute(update(table).where(
+        table.c.user_id == user_id, table.c.data_type == data_type).values(**increments))
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(
+            user_id=user_id, data_type=data_type, item_count=count, content_bytes=size))
+
+
+def rebuild_stats(connection, user_ids=None):
+    """Recompute the rollups of some users, or of all users when user_ids is None
+
+    Accepts a session or a connection, the caller commits.
+    """
+    table = VaultStats.__table__
+    items = EncryptedData.__table__
+    delete = table.delete()
+    aggregate = select(
+        items.c.user_id, items.c.data_type, func.count(),
+        func.coalesce(func.sum(func.length(items.c.encrypted_content)
+                               + func.coalesce(func.length(items.c.encrypted_tags), 0)), 0)
+    ).where(items.c.user_id.is_not(None)).group_by(items.c.user_id, items.c.data_type)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        delete = delete.where(table.c.user_id.in_(user_ids))
+        aggregate = aggregate.where(items.c.user_id.in_(user_ids))
+    connection.execute(delete)
+    connection.execute(insert(table).from_select(
+        ['user_id', 'data_type', 'item_count', 'content_bytes'], aggregate))
+
+
+def summary(session, top_users=50):
+    """Return the totals, the per type distribution and the largest vaults"""
+    items = func.coalesce(func.sum(VaultStats.item_count), 0)
+    size = func.coalesce(func.sum(VaultStats.content_bytes), 0)
+    total_items, total_bytes = session.query(items, size).one()
+
+    by_type = session.query(VaultStats.data_type, items, size).group_by(
+        VaultStats.data_type).order_by(items.desc()).all()
+    largest = session.query(User.id, User.username, items, size, User.vault_updated_at).join(
+        VaultStats, VaultStats.user_id == User.id).group_by(
+        User.id, User.username, User.vault_updated_at).order_by(size.desc()).limit(top_users).all()
+
+    return {
+        'users': session.query(func.count(User.id)).scalar(),
+        'items': total_items,
+        'bytes': total_bytes,
+        'by_type': [{'data_type': data_type, 'items': count, 'bytes': type_bytes}
+                    for data_type, count, type_bytes in by_type],
+        'top_users': [{
+            'id': user_id,
+            'username': username,
+            'items': count,
+            'bytes': user_bytes,
+            'updated_at': updated_at.isoformat() if updated_at else None
+        } for user_id, username, count, user_bytes, updated_at in largest]
+    }
+
+
+def last_sync(session):
+    """Return when the last sync completed, or None"""
+    state = session.get(SyncState, 1)
+    return state.last_synced_at if state is not None else None
+
+
+def record_sync(session, synced_at, items_changed):
+    """Record a completed sync, in the sync's transaction"""
+    session.merge(SyncState(id=1, last_synced_at=synced_at, items_changed=items_changed))
@@ -0,0 +1,229 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import search_index
+
+FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = ['id', 'data_type', 'content', 'tags', 'created_at', 'updated_at']
+MAX_DATA_TYPE_LENGTH = 50
+
+# Fernet suite of a crypto worker process, set by _init_worker
+_cipher = None
+
+
+def _init_worker(key):
+    global _cipher
+    from cryptography.fernet import Fernet
+    _cipher = Fernet(key.encode())
+
+
+def _encrypt(values):
+    """Encrypt a tuple of strings in a worker process, empty values become None"""
+    return tuple(_cipher.encrypt(value.encode()).decode() if value else None for value in values)
+
+
+def _decrypt(values):
+    return tuple(_cipher.decrypt(value.encode()).decode() if value else None for value in values)
+
+
+def crypto_pool(key, workers):
+    """Process pool for the Fernet work, which would otherwise hold the GIL"""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(key,))
+
+
+def _chunksize(batch_size, workers):
+    # A few chunks per worker and batch keeps the pickling overhead low
+    return max(1, batch_size // (workers * 4))
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    raise ValueError(f"Cannot tell the format of {path}, pass --format")
+
+
+def file_fingerprint(path, sample_size=1024 * 1024):
+    """Identify a file across runs by its size and the hash of its beginning"""
+    digest = hashlib.sha256(str(os.path.getsize(path)).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+def read_rows(f, fmt):
+    """Yield the records of a CSV or NDJSON stream, None for unreadable lines"""
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def parse_item(row, default_type):
+    """Return the data type, content and tags of an input record, None if invalid"""
+    if not isinstance(row, dict) or not row.get('content'):
+        return None
+    content = row['content'] if isinstance(row['content'], str) else json.dumps(row['content'])
+    data_type = row.get('data_type') or default_type
+    if not isinstance(data_type, str) or len(data_type) > MAX_DATA_TYPE_LENGTH:
+        return None
+    tags = row.get('tags') or ''
+    if isinstance(tags, list):
+        tags = ','.join(str(tag) for tag in tags)
+    elif not isinstance(tags, str):
+        return None
+    return {'data_type': data_type, 'content': content, 'tags': search_index.parse_tags(tags)}
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_vault(manager, user_id, path, key, fmt=None, default_type='note', batch_size=500,
+                 workers=None, restart=False, progress=None):
+    """Stream a CSV or NDJSON file into a user's vault
+
+    Records need a content field and may have data_type and tags (a comma
+    separated string or a list). Content is encrypted in a process pool
+    while the previous batch is stored, each batch in its own transaction
+    together with the import's progress, so an interrupted import resumes
+    after the last stored batch. Returns the numbers of imported and
+    rejected records of this run.
+    """
+    fmt = detect_format(path, fmt)
+    workers = workers or os.cpu_count() or 1
+    transfer_id, rows_done = manager.start_transfer(user_id, os.path.abspath(path), file_fingerprint(path), restart)
+    imported = rejected = 0
+
+    def store(items, encrypted, row_count):
+        nonlocal rows_done, imported, rejected
+        rows_done += row_count
+        manager.import_items(user_id, [
+            dict(item, encrypted_content=encrypted_content, encrypted_tags=encrypted_tags)
+            for item, (encrypted_content, encrypted_tags) in zip(items, encrypted)
+        ], transfer_id, rows_done)
+        imported += len(items)
+        rejected += row_count - len(items)
+        if progress:
+            progress(rows_done, None)
+
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f, crypto_pool(key, workers) as executor:
+        chunksize = _chunksize(batch_size, workers)
+        # Skip the records stored by an interrupted run
+        rows = itertools.islice(read_rows(f, fmt), rows_done, None)
+        pending = None
+        for batch in batches(rows, batch_size):
+            items = [item for item in (parse_item(row, default_type) for row in batch) if item is not None]
+            encrypted = executor.map(_encrypt, [(item['content'], ','.join(item['tags'])) for item in items],
+                                     chunksize=chunksize)
+            if pending:
+                store(*pending)
+            pending = (items, encrypted, len(batch))
+        if pending:
+            store(*pending)
+
+    manager.finish_transfer(transfer_id)
+    return imported, rejected
+
+
+def _open_private(path, flags):
+    # Exports hold plaintext, keep them readable by the owner only
+    return os.open(path, flags, 0o600)
+
+
+def export_vault(manager, user_id, path, key, fmt=None, batch_size=500, workers=None,
+                 resume=False, progress=None):
+    """Stream a user's vault, decrypted, to a CSV or NDJSON file ('-' for stdout)
+
+    Items are decrypted in a process pool while the previous batch is
+    written. After every batch a checkpoint next to the output records the
+    last item and the file size, so with resume an interrupted export
+    continues where it stopped. Returns the number of items written in this
+    run.
+    """
+    fmt = detect_format(path, fmt) if path != '-' else (fmt or 'ndjson')
+    checkpoint_path = path + '.progress'
+    after_id = 0
+    append = False
+    if resume and path != '-' and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint['user_id'] == user_id and checkpoint['format'] == fmt:
+            # Drop whatever was written after the last checkpoint
+            os.truncate(path, checkpoint['bytes'])
+            after_id = checkpoint['last_id']
+            append = True
+
+    workers = workers or os.cpu_count() or 1
+    total = manager.count_items(user_id, after_id)
+    written = 0
+    if path == '-':
+        out = sys.stdout
+    else:
+        out = open(path, 'a' if append else 'w', newline='', encoding='utf-8', opener=_open_private)
+    writer = csv.DictWriter(out, EXPORT_FIELDS) if fmt == 'csv' else None
+    if writer and not append:
+        writer.writeheader()
+
+    def write(rows, decrypted):
+        nonlocal written
+        for row, (content, tags) in zip(rows, decrypted):
+            record = {
+                'id': row.id,
+                'data_type': row.data_type,
+                'content': content,
+                'tags': tags or '',
+                'created_at': row.created_at.isoformat() if row.created_at else None,
+                'updated_at': row.updated_at.isoformat() if row.updated_at else None
+            }
+            if writer:
+                writer.writerow(record)
+            else:
+                out.write(json.dumps(record) + '\n')
+        written += len(rows)
+        out.flush()
+        if out is not sys.stdout:
+            with open(checkpoint_path + '.tmp', 'w') as f:
+                json.dump({'user_id': user_id, 'format': fmt, 'last_id': rows[-1].id, 'bytes': out.tell()}, f)
+            os.replace(checkpoint_path + '.tmp', checkpoint_path)
+        if progress:
+            progress(written, total)
+
+    try:
+        with crypto_pool(key, workers) as executor:
+            chunksize = _chunksize(batch_size, workers)
+            pending = None
+            for rows in manager.iter_items(user_id, after_id, batch_size):
+                decrypted = executor.map(_decrypt, [(row.encrypted_content, row.encrypted_tags) for row in rows],
+                                         chunksize=chunksize)
+                if pending:
+                    write(*pending)
+                pending = (rows, decrypted)
+            if pending:
+                write(*pending)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if path != '-' and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return written
@@ -0,0 +1,56 @@
+"""Write transactions on a user's vault
+
+Each function performs the whole write of one request on the given session,
+including the search index and the vault version, but does not commit. The
+caller commits, directly or through the write coalescer, which runs several
+of them in one transaction. Content and tags arrive already encrypted so no
+crypto work happens while the database write lock is held.
+"""
+from datetime import datetime
+from models import EncryptedData
+import search_index
+import vault_cache
+
+
+def add_item(session, user_id, data_type, encrypted_content, encrypted_tags, tags):
+    """Store a new item and return its id"""
+    item = EncryptedData(
+        user_id=user_id,
+        data_type=data_type,
+        encrypted_content=encrypted_content,
+        encrypted_tags=encrypted_tags
+    )
+    session.add(item)
+    session.flush() # Assign an id before indexing
+    search_index.index_item(session, item, tags)
+    vault_cache.bump_vault_version(session, [user_id])
+    return item.id
+
+
+def update_item(session, user_id, data_id, data_type, encrypted_content, encrypted_tags, tags):
+    """Update an item, keeping its content when encrypted_content is None
+
+    Returns False if the item no longer exists.
+    """
+    item = session.get(EncryptedData, data_id)
+    if item is None or item.user_id != user_id:
+        return False
+    item.data_type = data_type
+    if encrypted_content is not None:
+        item.encrypted_content = encrypted_content
+    item.encrypted_tags = encrypted_tags
+    item.updated_at = datetime.utcnow()
+    search_index.index_item(session, item, tags)
+    vault_cache.bump_vault_version(session, [user_id])
+    return True
+
+
+def delete_item(session, user_id, data_id):
+    """Delete an item, returns False if it no longer exists"""
+    item = session.get(EncryptedData, data_id)
+    if item is None or item.user_id != user_id:
+        return False
+    search_index.remove_item(session, data_id)
+    session.delete(item)
+    vault_cache.bump_vault_version(session, [user_id])
+    return True
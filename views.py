@@ -0,0 +1,269 @@
+import time
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, make_response, jsonify
+from flask_login import login_user, logout_user, login_required, current_user
+from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import OperationalError
+from extensions import db, login_manager, fragment_cache, write_coalescer
+from managers import get_backup_manager
+from models import User, EncryptedData, encrypt_value
+import search_index
+import vault_cache
+import vault_stats
+import vault_writes
+from profiling import span
+from db_routing import read_only
+
+main = Blueprint('main', __name__)
+
+@main.app_errorhandler(OperationalError)
+def database_unavailable(error):
+    """Turn SQLite lock timeouts into a retryable 503 instead of a 500"""
+    db.session.rollback()
+    if 'database is locked' not in str(error.orig):
+        raise error
+    return 'The database is busy, please retry.', 503, {'Retry-After': '1'}
+
+@login_manager.user_loader
+def load_user(user_id):
+    return User.query.get(int(user_id))
+
+@main.route('/')
+def index():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.dashboard'))
+    return render_template('index.html')
+
+@main.route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        email = request.form.get('email')
+        
+        if User.query.filter_by(username=username).first():
+            flash('Username already exists')
+            return redirect(url_for('main.register'))
+        
+        with span('password_hash'):
+            password_hash = generate_password_hash(password)
+        
+        user = User(
+            username=username,
+            password_hash=password_hash,
+            email=email
+        )
+        db.session.add(user)
+        db.session.commit()
+        
+        flash('Registration successful')
+        return redirect(url_for('main.login'))
+    
+    return render_template('register.html')
+
+@main.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        
+        user = User.query.filter_by(username=username).first()
+        with span('password_hash'):
+            password_valid = user is not None and check_password_hash(user.password_hash, password)
+        if password_valid:
+            login_user(user)
+            return redirect(url_for('main.dashboard'))
+        
+        flash('Invalid username or password')
+    
+    return render_template('login.html')
+
+@main.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('main.index'))
+
+@main.route('/dashboard')
+@read_only
+@login_required
+def dashboard():
+    not_modified = vault_cache.not_modified(current_user)
+    if not_modified:
+        return not_modified
+    
+    def render_items():
+        user_data = EncryptedData.query.filter_by(user_id=current_user.id).all()
+        return render_template('_dashboard_items.html', data=user_data)
+    
+    items_html = fragment_cache.get_or_render(current_user, 'dashboard', render_items)
+    response = make_response(render_template('dashboard.html', items_html=items_html))
+    return vault_cache.set_validators(response, current_user)
+
+@main.route('/data/new', methods=['GET', 'POST'])
+@login_required
+def new_data():
+    if request.method == 'POST':
+        data_type = request.form.get('data_type')
+        content = request.form.get('content')
+        tags = search_index.parse_tags(request.form.get('tags'))
+
+        # Encrypt the content before it is handed to the writer
+        encrypted_content_data = EncryptedData().encrypt_content(content)
+        encrypted_tags = encrypt_value(','.join(tags)) if tags else None
+
+        write_coalescer.submit(vault_writes.add_item, current_user.id, data_type,
+                               encrypted_content_data, encrypted_tags, tags)
+        fragment_cache.invalidate_user(current_user.id)
+        
+        flash('Data added successfully')
+        return redirect(url_for('main.dashboard'))
+    
+    return render_template('new_data.html')
+
+@main.route('/data/<int:data_id>')
+@read_only
+@login_required
+def view_data(data_id):
+    not_modified = vault_cache.not_modified(current_user)
+    if not_modified:
+        return not_modified
+    
+    data = EncryptedData.query.get_or_404(data_id)
+    if data.user_id != current_user.id:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    response = make_response(render_template('view_data.html', data=data))
+    return vault_cache.set_validators(response, current_user)
+
+@main.route('/data/<int:data_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_data(data_id):
+    data = EncryptedData.query.get_or_404(data_id)
+    if data.user_id != current_user.id:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    if request.method == 'POST':
+        tags = search_index.parse_tags(request.form.get('tags'))
+        content = request.form.get('content')
+        encrypted_content = data.encrypt_content(content) if content else None
+        encrypted_tags = encrypt_value(','.join(tags)) if tags else None
+        
+        updated = write_coalescer.submit(vault_writes.update_item, current_user.id, data.id,
+                                         request.form.get('data_type'), encrypted_content, encrypted_tags, tags)
+        fragment_cache.invalidate_user(current_user.id)
+        # Deleted by another request since it was loaded
+        flash('Data updated successfully' if updated else 'This data no longer exists')
+        return redirect(url_for('main.dashboard'))
+    
+    return render_template('edit_data.html', data=data)
+
+@main.route('/data/<int:data_id>/delete', methods=['POST'])
+@login_required
+def delete_data(data_id):
+    data = EncryptedData.query.get_or_404(data_id)
+    if data.user_id != current_user.id:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    deleted = write_coalescer.submit(vault_writes.delete_item, current_user.id, data.id)
+    fragment_cache.invalidate_user(current_user.id)
+    flash('Data deleted successfully' if deleted else 'This data no longer exists')
+    return redirect(url_for('main.dashboard'))
+
+@main.route('/search')
+@read_only
+@login_required
+def search():
+    query = request.args.get('q', '').strip()
+    results = search_index.search(db.session, current_user.id, query) if query else []
+    return render_template('search.html', query=query, data=results)
+
+@main.route('/backups')
+@read_only
+@login_required
+def list_backups():
+    if not current_user.is_admin:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    backup_manager = get_backup_manager()
+    per_page = current_app.config['BACKUPS_PER_PAGE']
+    page = max(request.args.get('page', 1, type=int), 1)
+    total = backup_manager.count_backups()
+    pages = max((total + per_page - 1) // per_page, 1)
+    
+    backups = backup_manager.list_backups(limit=per_page, offset=(page - 1) * per_page)
+    return render_template('backups.html', backups=backups, page=page, pages=pages, total=total)
+
+@main.route('/backups/create', methods=['POST'])
+@login_required
+def create_backup():
+    if not current_user.is_admin:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    backup_path = get_backup_manager().create_backup()
+    flash(f'Backup created successfully at {backup_path}')
+    return redirect(url_for('main.list_backups'))
+
+@main.route('/backups/<path:backup_path>/restore', methods=['POST'])
+@login_required
+def restore_backup(backup_path):
+    if not current_user.is_admin:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    get_backup_manager().restore_backup(backup_path)
+    fragment_cache.clear()
+    flash('Backup restored successfully')
+    return redirect(url_for('main.list_backups'))
+
+@main.route('/backups/<path:backup_path>/delete', methods=['POST'])
+@login_required
+def delete_backup(backup_path):
+    if not current_user.is_admin:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    get_backup_manager().delete_backup(backup_path)
+    flash('Backup deleted successfully')
+    return redirect(url_for('main.list_backups'))
+
+def _admin_statistics():
+    """Collect the vault statistics and how far sync and backups are behind"""
+    stats = vault_stats.summary(db.session, current_app.config['ADMIN_STATS_TOP_USERS'])
+    
+    last_sync = vault_stats.last_sync(db.session)
+    stats['sync'] = {
+        'configured': bool(current_app.config['CLOUD_DATABASE_URL']),
+        'last': last_sync.replace(tzinfo=timezone.utc).isoformat() if last_sync else None,
+        'lag_seconds': (datetime.utcnow() - last_sync).total_seconds() if last_sync else None
+    }
+    last_backup = get_backup_manager().last_backup_time()
+    stats['backup'] = {
+        'last': datetime.fromtimestamp(last_backup, timezone.utc).isoformat() if last_backup else None,
+        'lag_seconds': time.time() - last_backup if last_backup else None
+    }
+    return stats
+
+@main.route('/admin/stats')
+@read_only
+@login_required
+def admin_stats():
+    if not current_user.is_admin:
+        flash('Access denied')
+        return redirect(url_for('main.dashboard'))
+    
+    return render_template('admin_stats.html', stats=_admin_statistics())
+
+@main.route('/admin/stats.json')
+@read_only
+@login_required
+def admin_stats_json():
+    if not current_user.is_admin:
+        return jsonify(error='Access denied'), 403
+    
+    return jsonify(_admin_statistics())
@@ -0,0 +1,117 @@
+import signal
+import threading
+from functools import partial
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from app import app
+from managers import get_sync_manager, get_backup_manager
+from leader_lock import LeaderLock
+from load_monitor import read_load
+from scheduler import Scheduler
+
+
+def maintain_database(engine):
+    """Refresh the query planner statistics of the local database"""
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            connection.execute(text("PRAGMA optimize"))
+        connection.execute(text("ANALYZE"))
+        connection.commit()
+
+
+def create_scheduler(config, sync_manager, backup_manager):
+    """Create the scheduler with all background jobs of the application"""
+    scheduler = Scheduler(
+        load_source=partial(read_load, config['LOAD_STATE_DIR']),
+        max_latency_ms=config['LOAD_MAX_LATENCY_MS'],
+        max_in_flight=config['LOAD_MAX_IN_FLIGHT'],
+        defer_interval=config['LOAD_DEFER_INTERVAL'],
+        max_defer=config['LOAD_MAX_DEFER'],
+        stop_timeout=config['SCHEDULER_STOP_TIMEOUT']
+    )
+    job_options = {
+        'jitter': config['SCHEDULER_JITTER'],
+        'retry_delay': config['SCHEDULER_RETRY_DELAY'],
+        'max_backoff': config['SCHEDULER_MAX_BACKOFF'],
+        # Jobs of the same group never touch the database at the same time
+        'group': 'database'
+    }
+
+    scheduler.add_job('sync', sync_manager.sync_data, config['SYNC_INTERVAL'], **job_options)
+    scheduler.add_job('backup', backup_manager.create_backup, config['BACKUP_INTERVAL'],
+                      heavy=True, **job_options)
+    scheduler.add_job('retention', partial(
+        backup_manager.apply_retention,
+        config['BACKUP_KEEP_HOURLY'], config['BACKUP_KEEP_DAILY'], config['BACKUP_KEEP_WEEKLY']
+    ), config['BACKUP_RETENTION_INTERVAL'], heavy=True, **job_options)
+    scheduler.add_job('verify', backup_manager.verify_pending, config['BACKUP_VERIFY_INTERVAL'],
+                      heavy=True, **job_options)
+
+    maintenance_engine = create_engine(config['SQLALCHEMY_DATABASE_URI'])
+    scheduler.add_job('maintenance', partial(maintain_database, maintenance_engine),
+                      config['MAINTENANCE_INTERVAL'], heavy=True,
+                      initial_delay=config['MAINTENANCE_INTERVAL'], **job_options)
+    return scheduler
+
+
+class Worker:
+    """Background process owning sync and backups
+
+    Any number of workers may be started, only the one holding the leader
+    lock runs the jobs while the others wait on standby to take over.
+    """
+
+    def __init__(self, scheduler, lock, standby_interval=15):
+        self.scheduler = scheduler
+        self.lock = lock
+        self.standby_interval = standby_interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """Run until stop() is called"""
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    acquired = self.lock.acquire()
+                except (SQLAlchemyError, OSError) as e:
+                    # The database or lock file is unavailable, retry on standby
+                    print(f"Worker could not take the leader lock: {e}")
+                    acquired = False
+                if not acquired:
+                    self.stop_event.wait(self.standby_interval)
+                    continue
+
+                print("Worker is the leader, starting background jobs")
+                self.scheduler.start()
+                # Keep checking that leadership has not been lost
+                while not self.stop_event.wait(self.standby_interval):
+                    if not self.lock.check():
+                        print("Worker lost leadership, stopping background jobs")
+                        break
+                self.scheduler.stop()
+        finally:
+            self.lock.release()
+
+    def stop(self, *args):
+        """Request shutdown, safe to use as a signal handler"""
+        self.stop_event.set()
+
+
+def main():
+    lock = LeaderLock(
+        db_url=app.config['SQLALCHEMY_DATABASE_URI'],
+        lock_file=app.config['WORKER_LOCK_FILE']
+    )
+    worker = Worker(
+        create_scheduler(app.config, get_sync_manager(app), get_backup_manager(app)), lock,
+        standby_interval=app.config['WORKER_STANDBY_INTERVAL']
+    )
+
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from sqlalchemy import text
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+
+class WriteCoalescer:
+    """Group commit for the small write transactions of concurrent requests
+
+    With WRITE_COALESCING enabled, submit() hands the write to a dedicated
+    writer thread instead of committing on the request's own session. The
+    writer collects the writes submitted within WRITE_COALESCE_WINDOW_MS (at
+    most WRITE_COALESCE_MAX_BATCH), runs each in its own SAVEPOINT and
+    commits them together, paying for one write lock and one fsync per
+    batch. A failing write only rolls back its savepoint; every caller gets
+    its own result or exception, and only after the batch is durable. A
+    caller waits at most WRITE_COALESCE_TIMEOUT seconds for the writer to
+    pick its write up; a write that timed out is cancelled and never runs,
+    one the writer has started is waited for.
+
+    Disabled, submit() runs the write and commits it in the request.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.enabled = False
+        self.app = None
+        self.window = 0.0
+        self.max_batch = 1
+        self.timeout = None
+        self.queue = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config['WRITE_COALESCING']
+        self.window = app.config['WRITE_COALESCE_WINDOW_MS'] / 1000
+        self.max_batch = app.config['WRITE_COALESCE_MAX_BATCH']
+        self.timeout = app.config['WRITE_COALESCE_TIMEOUT']
+        self.app = app
+
+    def submit(self, write, *args):
+        """Run write(session, *args) and commit it, returning its result"""
+        if not self.enabled:
+            result = write(self.db.session, *args)
+            self.db.session.commit()
+            return result
+
+        future = Future()
+        self._start_writer()
+        with span('write_coalesce'):
+            self.queue.put((future, write, args))
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                if future.cancel():
+                    raise
+                # Already in a batch, it commits or fails with it
+                return future.result()
+
+    def _start_writer(self):
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self._run, name='write-coalescer', daemon=True)
+                self.writer.start()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    self._write_batch(self._collect_batch())
+                except Exception:
+                    # Keep the writer alive, the batch's callers were resolved
+                    logger.exception("Write coalescer error")
+
+    def _collect_batch(self):
+        """Wait for a write, then gather the ones arriving within the window"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                # Writes queued during the previous commit join without waiting
+                batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        # Drop the writes whose callers gave up waiting, the others can no longer be cancelled
+        batch = [entry for entry in batch if entry[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            try:
+                results = self._commit_batch(batch)
+            except Exception as e:
+                logger.warning("Coalesced write of %d transactions failed: %s", len(batch), e)
+                results = [(future, None, e) for future, write, args in batch]
+                self.db.session.rollback()
+            finally:
+                self.db.session.remove()
+        finally:
+            # Every caller is resolved, even if the rollback or the cleanup failed
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            for future, write, args in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("The coalesced write failed"))
+
+    def _commit_batch(self, batch):
+        """Run the writes of a batch in savepoints and commit, return (future, result, error) of each"""
+        session = self.db.session
+        results = []
+        if self.db.engine.dialect.name == 'sqlite':
+            # pysqlite only begins a transaction for DML, a SAVEPOINT would
+            # otherwise start (and its release commit) a transaction of its own
+            session.execute(text('BEGIN IMMEDIATE'))
+        for future, write, args in batch:
+            savepoint = session.begin_nested()
+            try:
+                result = write(session, *args)
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                results.append((future, None, e))
+            else:
+                results.append((future, result, None))
+        session.commit()
+        return results